@@ -5,13 +5,14 @@ from PyQt5.QtGui import QCloseEvent
 from PyQt5.uic import loadUi
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 from PyQt5 import QtCore
-from sqlalchemy.engine import TupleResult
+import numpy as np
 
 import workload_generator
+from model_cache import ModelCache
+from ui_workers import TaskWorker
 import json
 from datetime import datetime
 import load_data
-import plot
 
 # TODO додати можливість вводу кількості станів
 # TODO візуалізація матриці переходів
@@ -24,6 +25,11 @@ class MainWindow(QMainWindow):
         self.__dataset_path = 'datasets/workload_dataset/workload.csv'
         self.__config_path = 'middle_config.json'
         self.__configure_mode = 'config'
+        self.__model_cache = ModelCache()
+        self.__thread = None
+        self.__worker = None
+        self.__chunks = []
+        self.__timeseries = []
         self.setup()
 
     def setup(self):
@@ -41,6 +47,7 @@ class MainWindow(QMainWindow):
         self.startDateTimeEdit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
         self.endDateTimeEdit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
         self.actionSave.triggered.connect(lambda: self.debug(self.save_dataset))
+        self.cancelButton.clicked.connect(self.cancel_task)
         self.plotDatasetButton.clicked.connect(lambda: self.debug(self.plot_dataset))
         self.load_config()
 
@@ -59,7 +66,50 @@ class MainWindow(QMainWindow):
     def __set_configure_mode(self, mode: str):
         self.__configure_mode = mode
 
+    @staticmethod
+    def show_message(text):
+        msg = QMessageBox()
+        msg.setText(text)
+        msg.exec_()
+
+    def __set_task_running(self, running):
+        self.generateButton.setEnabled(not running)
+        self.actionSave.setEnabled(not running)
+        self.plotButton.setEnabled(not running and bool(self.__timeseries))
+        self.cancelButton.setEnabled(running)
+
+    def __start_task(self, on_finished, task, *args, on_chunk=None):
+        if self.__thread is not None:
+            raise RuntimeError("Попередня операція ще виконується")
+        self.progressBar.setValue(0)
+        self.__thread = QtCore.QThread(self)
+        self.__worker = TaskWorker(task, *args)
+        self.__worker.moveToThread(self.__thread)
+        self.__thread.started.connect(self.__worker.run)
+        self.__worker.progress.connect(self.progressBar.setValue)
+        if on_chunk is not None:
+            self.__worker.chunk.connect(on_chunk)
+        self.__worker.finished.connect(on_finished)
+        self.__worker.failed.connect(self.show_message)
+        self.__worker.cancelled.connect(lambda: self.show_message("Операцію скасовано"))
+        for signal in (self.__worker.finished, self.__worker.failed, self.__worker.cancelled):
+            signal.connect(self.__finish_task)
+        self.__set_task_running(True)
+        self.__thread.start()
+
+    def __finish_task(self, *args):
+        self.__thread.quit()
+        self.__thread.wait()
+        self.__thread = None
+        self.__worker = None
+        self.__set_task_running(False)
+
+    def cancel_task(self):
+        if self.__worker is not None:
+            self.__worker.cancel()
+
     def plot_dataset(self):
+        import plot
         plot.plot_dataset(load_data.load_dataset(self.chooseDatasetLineEdit.text()))
 
     def load_config(self):
@@ -100,37 +150,34 @@ class MainWindow(QMainWindow):
         with open('ui_config.json', 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False)
 
-    def config_from_dataset(self):
-        if not os.path.isfile("config.json"):
-            self.__workload_generator.configure(self.chooseDatasetLineEdit.text())
-        else:
-            with open("config.json", "r", encoding='utf-8') as f:
-                data = f.read()
-                if data == "":
-                    self.__workload_generator.configure(self.__dataset_path)
-                else:
-                    json_data = json.loads(data)
-                    json_data = json_data["DatasetPath"]
-                    if json_data != self.__dataset_path:
-                        self.__workload_generator.configure(self.__dataset_path)
-                    else:
-                        try:
-                            self.__workload_generator.load_config()
-                        except Exception as ex:
-                            self.__workload_generator.configure(self.__dataset_path)
+    def config_from_dataset(self, dataset_path=None):
+        self.__workload_generator.configure(dataset_path or self.chooseDatasetLineEdit.text(), cache=self.__model_cache)
 
-    def generate(self):
-        self.__workload_generator.set_states(self.statesSpinBox.value())
-        if self.__configure_mode == 'config':
-            self.__workload_generator.load_config(self.configPathLineEdit.text())
+    def __generate_task(self, worker, states, configure_mode, config_path, dataset_path, from_timestamp, to_timestamp,
+                        step, count):
+        self.__workload_generator.set_states(states)
+        if configure_mode == 'config':
+            self.__workload_generator.load_config(config_path)
         else:
-            self.config_from_dataset()
-
-        from_timestamp = int(datetime.strptime(self.startDateTimeEdit.dateTime().toString(self.startDateTimeEdit.displayFormat()), "%Y-%m-%d %H:%M:%S").timestamp())
-        to_timestamp = int(datetime.strptime(self.endDateTimeEdit.dateTime().toString(self.endDateTimeEdit.displayFormat()), "%Y-%m-%d %H:%M:%S").timestamp())
-        print(datetime.fromtimestamp(from_timestamp))
-        print(datetime.fromtimestamp(to_timestamp))
-        self.__workload_generator.generate(from_timestamp, to_timestamp, self.stepSpinBox.value(), self.microservicesCountSpinBox.value())
+            self.config_from_dataset(dataset_path)
+        worker.check_cancelled()
+
+        length = len(range(from_timestamp, to_timestamp + 1, step))
+        generated = 0
+        for chunk in self.__workload_generator.iter_generate(from_timestamp, to_timestamp, step, count,
+                                                             min(max(length // 100, 1), 4096)):
+            worker.check_cancelled()
+            worker.chunk.emit(chunk)
+            generated += len(chunk["Timestamp"])
+            worker.progress.emit(int(100 * generated / length))
+        return count
+
+    def __add_chunk(self, chunk):
+        self.__chunks.append(chunk)
+
+    def __generated(self, count):
+        self.__timeseries = self.__workload_generator.collect(self.__chunks, count)
+        self.__chunks = []
 
         msg = QMessageBox()
         msg.setText("Часовий ряд згенеровано успішно!")
@@ -138,7 +185,18 @@ class MainWindow(QMainWindow):
 
         self.plotButton.setEnabled(True)
         self.microserviceNumberComboBox.clear()
-        self.microserviceNumberComboBox.addItems(list(str(i) for i in range(1, self.microservicesCountSpinBox.value() + 1)))
+        self.microserviceNumberComboBox.addItems(list(str(i) for i in range(1, count + 1)))
+
+    def generate(self):
+        from_timestamp = int(datetime.strptime(self.startDateTimeEdit.dateTime().toString(self.startDateTimeEdit.displayFormat()), "%Y-%m-%d %H:%M:%S").timestamp())
+        to_timestamp = int(datetime.strptime(self.endDateTimeEdit.dateTime().toString(self.endDateTimeEdit.displayFormat()), "%Y-%m-%d %H:%M:%S").timestamp())
+        print(datetime.fromtimestamp(from_timestamp))
+        print(datetime.fromtimestamp(to_timestamp))
+        self.__chunks = []
+        self.__start_task(self.__generated, self.__generate_task, self.statesSpinBox.value(), self.__configure_mode,
+                          self.configPathLineEdit.text(), self.chooseDatasetLineEdit.text(), from_timestamp,
+                          to_timestamp, self.stepSpinBox.value(), self.microservicesCountSpinBox.value(),
+                          on_chunk=self.__add_chunk)
 
     def choose_dataset(self):
         fname = QFileDialog(self).getOpenFileName(self, 'Open file',
@@ -159,9 +217,26 @@ class MainWindow(QMainWindow):
         fname = QFileDialog.getExistingDirectory(self, "Select Directory", "", options=options)
         if not fname:
             return
-        self.__workload_generator.save(fname)
+        self.__start_task(lambda result: self.show_message("Часові ряди збережено"), self.__save_task, fname,
+                          self.__timeseries)
+
+    def __save_task(self, worker, directory, timeseries):
+        def chunks():
+            for num, series in enumerate(timeseries):
+                worker.check_cancelled()
+                worker.progress.emit(int(100 * num / len(timeseries)))
+                chunk = {"Microservice": np.array([num + 1]), "Timestamp": series["Timestamp"]}
+                chunk.update({key: series[key][None, :] for key in workload_generator.MarkovChain.METRICS})
+                yield chunk
+
+        self.__workload_generator.save(directory, chunks())
+        worker.progress.emit(100)
 
     def closeEvent(self, event: QCloseEvent):
+        if self.__thread is not None:
+            self.__worker.cancel()
+            self.__thread.quit()
+            self.__thread.wait()
         self.save_config()
         event.accept()
 
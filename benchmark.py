@@ -0,0 +1,169 @@
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os.path
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import load_data
+from workload_generator import MarkovChain
+
+
+DATASETS = "datasets/workload_dataset/[0-9]*.csv"
+PHASE_KEYS = ("load_dataset_cold", "load_dataset_warm", "configure", "generate", "save_csv", "save_npz")
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(phases, name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    phases[name] = time.perf_counter() - start
+    return result
+
+
+def run_case(case):
+    states, step, horizon, count, datasets, seed = case
+    paths = sorted(glob.glob(datasets))
+    phases = {}
+
+    rows = len(timed(phases, "load_dataset_cold", load_data.load_dataset, paths[0], cache=False)["CPU"])
+    load_data.load_dataset(paths[0])
+    timed(phases, "load_dataset_warm", load_data.load_dataset, paths[0])
+
+    markov_chain = MarkovChain(states, seed)
+    markov_chain.set_states(states)
+    with tempfile.TemporaryDirectory() as directory:
+        timed(phases, "configure", markov_chain.configure_many, paths, 1, os.path.join(directory, "config.json"))
+        timeseries = timed(phases, "generate", markov_chain.generate, 0, horizon, step, count)
+        samples = sum(len(series["Timestamp"]) for series in timeseries) * len(MarkovChain.METRICS)
+        for format in ("csv", "npz"):
+            output = os.path.join(directory, format)
+            timed(phases, f"save_{format}", markov_chain.save, output, format=format)
+
+    return {
+        "states": states,
+        "step": step,
+        "horizon": horizon,
+        "count": count,
+        "dataset_rows": rows,
+        "samples": samples,
+        "samples_per_sec": samples / phases["generate"] if phases["generate"] else None,
+        "phases": phases,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def best_of(results):
+    best = dict(results[0])
+    best["phases"] = {phase: min(result["phases"][phase] for result in results) for phase in results[0]["phases"]}
+    best["samples_per_sec"] = best["samples"] / best["phases"]["generate"] if best["phases"]["generate"] else None
+    best["peak_rss_kb"] = max(result["peak_rss_kb"] for result in results)
+    return best
+
+
+def case_key(result):
+    return result["states"], result["step"], result["horizon"], result["count"]
+
+
+def case_samples(step, horizon, count):
+    return len(range(0, horizon + 1, step)) * count * len(MarkovChain.METRICS)
+
+
+def run_benchmarks(states, steps, horizons, counts, datasets=DATASETS, seed=0, repeat=3, max_samples=10 ** 8):
+    cases = [(*case, datasets, seed) for case in itertools.product(states, steps, horizons, counts)
+             if case_samples(*case[1:]) <= max_samples]
+    skipped = len(states) * len(steps) * len(horizons) * len(counts) - len(cases)
+    if skipped:
+        print(f"Skipping {skipped} case(s) above {max_samples:,} samples", flush=True)
+    # a fresh interpreter per run keeps peak RSS attributable to that case alone
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        results = []
+        for case in cases:
+            result = best_of(pool.map(run_case, [case] * repeat))
+            print(f"states={result['states']:>2} step={result['step']:>5} horizon={result['horizon']:>7} "
+                  f"count={result['count']:>5}  {result['samples_per_sec'] or 0:>14,.0f} samples/s  "
+                  f"peak RSS {result['peak_rss_kb'] / 1024:,.1f} MiB", flush=True)
+            results.append(result)
+    return {
+        "commit": current_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold=0.2, min_delta=0.005):
+    regressions = []
+    baseline_results = {case_key(result): result for result in baseline["results"]}
+    for result in report["results"]:
+        previous = baseline_results.get(case_key(result))
+        if previous is None:
+            continue
+        for phase in PHASE_KEYS:
+            old, new = previous["phases"].get(phase), result["phases"].get(phase)
+            if old and new and new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append(f"{case_key(result)} {phase}: {old:.4f}s -> {new:.4f}s")
+        if previous["peak_rss_kb"] and result["peak_rss_kb"] > previous["peak_rss_kb"] * (1 + threshold):
+            regressions.append(f"{case_key(result)} peak RSS: {previous['peak_rss_kb']} KB -> "
+                               f"{result['peak_rss_kb']} KB")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Markov chain training, generation and I/O.")
+    parser.add_argument("--states", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 60])
+    parser.add_argument("--horizons", type=int, nargs="+", default=[3600, 86400])
+    # the large fleet catches per-microservice overhead that small counts cannot show
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 100, 100000])
+    parser.add_argument("--datasets", default=DATASETS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest phase times are kept")
+    parser.add_argument("--max-samples", type=int, default=10 ** 8,
+                        help="skip cases that would generate more samples than this")
+    parser.add_argument("--output", default=None, help="defaults to benchmarks/<commit>.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="ignore slowdowns below this many seconds")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.states, args.steps, args.horizons, args.counts, args.datasets, args.seed,
+                            args.repeat, args.max_samples)
+
+    output = args.output or os.path.join("benchmarks", f"{report['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results -> {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import glob
+import os.path
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import load_data
+from workload_generator import MarkovChain, TimeSeriesModelling, generate_sharded, merge_manifests
+
+
+DATASETS = "datasets/workload_dataset/[0-9]*.csv"
+
+
+def same_timeseries(left, right):
+    return len(left) == len(right) and all(
+        np.array_equal(a[key], b[key]) for a, b in zip(left, right) for key in ("Timestamp", *MarkovChain.METRICS))
+
+
+def same_counts(left, right):
+    return left is not None and right is not None and left.keys() == right.keys() and \
+        all(np.array_equal(left[key], right[key]) for key in left)
+
+
+def train_configs(paths, directory, states):
+    dense = os.path.join(directory, "dense.json")
+    markov_chain = MarkovChain()
+    markov_chain.set_states(states)
+    markov_chain.configure_many(paths, 1, dense)
+
+    joint = os.path.join(directory, "joint.json")
+    markov_chain = MarkovChain(joint=True)
+    markov_chain.set_states(states)
+    markov_chain.configure_many(paths, 1, joint)
+
+    timeseries = os.path.join(directory, "timeseries.npz")
+    TimeSeriesModelling().configure(paths, timeseries)
+    return {"dense": dense, "joint": joint, "timeseries": timeseries}
+
+
+def check_shards(name, config_path, directory, count, horizon, seed):
+    # the same seed must give the same series however the fleet is split over workers, chunks, shards and formats
+    def run(label, format="npz", workers=1, chunk_size=4096, shards=1):
+        output = os.path.join(directory, f"{name}-{label}")
+        for index in range(shards):
+            generate_sharded(config_path, 0, horizon, None, count, output, format, seed, workers, chunk_size,
+                             shard=(index, shards))
+        if shards > 1:
+            merge_manifests(output)
+        return load_data.load_timeseries(output)
+
+    expected = run("baseline")
+    variants = {
+        "workers": run("workers", workers=3, chunk_size=7),
+        "shards": run("shards", chunk_size=13, shards=3),
+        "csv": run("csv", format="csv", workers=2),
+    }
+    return [f"{name} shards: {label} differs from a single worker"
+            for label, timeseries in variants.items() if not same_timeseries(expected, timeseries)]
+
+
+def check_update(path, directory, states, joint):
+    # training on a prefix that ends in a half-written row, then folding in the rest, must count what a retrain counts
+    name = f"{os.path.splitext(os.path.basename(path))[0]}-{'joint' if joint else 'dense'}"
+    with open(path, "rb") as f:
+        data = f.read()
+    lines = data.splitlines(keepends=True)
+    middle = sum(len(line) for line in lines[:len(lines) // 2]) + len(lines[len(lines) // 2]) // 2
+    trace = os.path.join(directory, f"{name}-trace.csv")
+    config_path = os.path.join(directory, f"{name}-update.json")
+    with open(trace, "wb") as f:
+        f.write(data[:middle])
+    markov_chain = MarkovChain(joint=joint)
+    markov_chain.set_states(states)
+    markov_chain.configure_many([trace], 1, config_path)
+
+    with open(trace, "ab") as f:
+        f.write(data[middle:])
+    updated = MarkovChain(states)
+    updated.load_config(config_path)
+    updated.update(os.path.join(directory, ".", os.path.basename(trace)), config_path=config_path)
+
+    retrained = MarkovChain(joint=joint)
+    retrained.set_states(states)
+    retrained.configure_many([trace], 1, os.path.join(directory, f"{name}-retrain.json"))
+    if not same_counts(updated.transition_counts, retrained.transition_counts):
+        return [f"{name} update: counts differ from retraining"]
+    return []
+
+
+def run_checks(datasets=DATASETS, files=4, states=5, count=10, horizon=30000, seed=0):
+    paths = sorted(glob.glob(datasets))[:files]
+    if not paths:
+        raise FileNotFoundError(f"No datasets matching {datasets}")
+    directory = tempfile.mkdtemp()
+    try:
+        failures = []
+        configs = train_configs(paths, directory, states)
+        for name, config_path in configs.items():
+            failures += check_shards(name, config_path, directory, count, horizon, seed)
+        # a trace that ends where its first half ends hides a stale wrap-around transition, so every file is checked
+        for path in paths:
+            for joint in (False, True):
+                failures += check_update(path, directory, states, joint)
+        return failures
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that sharded generation is bit-identical and that "
+                                                 "incremental updates match retraining.")
+    parser.add_argument("--datasets", default=DATASETS)
+    parser.add_argument("--files", type=int, default=4, help="number of dataset files to train on")
+    parser.add_argument("--states", type=int, default=5)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--horizon", type=int, default=30000, help="seconds of series to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = run_checks(args.datasets, args.files, args.states, args.count, args.horizon, args.seed)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+    print("All consistency checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+ENABLE_VARIABLE = "WORKLOAD_GENERATOR_INSTRUMENTATION"
+PROFILE_VARIABLE = "WORKLOAD_GENERATOR_PROFILE"
+PROMETHEUS_PREFIX = "workload_generator"
+# counter -> phase whose time it is divided by to report a throughput
+RATES = {
+    "dataset_rows": "load_dataset",
+    "samples": "sample",
+    "bytes_written": "write",
+    "plotted_points": "plot",
+}
+
+
+class Instrumentation:
+    def __init__(self, enabled=False):
+        self.__enabled = enabled
+        self.__lock = threading.Lock()
+        self.__phases = {}
+        self.__counters = {}
+
+    @property
+    def enabled(self):
+        return self.__enabled
+
+    def enable(self, enabled=True):
+        self.__enabled = enabled
+
+    def reset(self):
+        with self.__lock:
+            self.__phases = {}
+            self.__counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        if not self.__enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.__lock:
+                calls, seconds = self.__phases.get(name, (0, 0.0))
+                self.__phases[name] = (calls + 1, seconds + elapsed)
+
+    def count(self, name, value=1):
+        if not self.__enabled:
+            return
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def merge(self, snapshot):
+        if not self.__enabled:
+            return
+        with self.__lock:
+            for name, phase in snapshot["Phases"].items():
+                calls, seconds = self.__phases.get(name, (0, 0.0))
+                self.__phases[name] = (calls + phase["Calls"], seconds + phase["Seconds"])
+            for name, value in snapshot["Counters"].items():
+                self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.__lock:
+            phases = {name: {"Calls": calls, "Seconds": seconds} for name, (calls, seconds) in self.__phases.items()}
+            counters = dict(self.__counters)
+        rates = {f"{counter}_per_second": counters[counter] / phases[phase]["Seconds"]
+                 for counter, phase in RATES.items()
+                 if counter in counters and phase in phases and phases[phase]["Seconds"] > 0}
+        return {"Phases": phases, "Counters": counters, "Rates": rates}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_phase_seconds_total counter"]
+        lines += [f'{PROMETHEUS_PREFIX}_phase_seconds_total{{phase="{name}"}} {phase["Seconds"]:.9g}'
+                  for name, phase in sorted(snapshot["Phases"].items())]
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_phase_calls_total counter")
+        lines += [f'{PROMETHEUS_PREFIX}_phase_calls_total{{phase="{name}"}} {phase["Calls"]}'
+                  for name, phase in sorted(snapshot["Phases"].items())]
+        for name, value in sorted(snapshot["Counters"].items()):
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter", f"{PROMETHEUS_PREFIX}_{name}_total {value}"]
+        for name, value in sorted(snapshot["Rates"].items()):
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge", f"{PROMETHEUS_PREFIX}_{name} {value:.9g}"]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+instrumentation = Instrumentation(os.environ.get(ENABLE_VARIABLE, "") not in ("", "0"))
+phase = instrumentation.phase
+count = instrumentation.count
+
+
+# (pid, profiler, memory) of every profile() block that is running; forked workers inherit these
+active_profiles = []
+worker_profiler = None
+
+
+def stop_inherited_profiles():
+    inherited = [(pid, profiler, memory) for pid, profiler, memory in active_profiles if pid != os.getpid()]
+    for entry in inherited:
+        entry[1].disable()
+        active_profiles.remove(entry)
+    if any(memory for _, _, memory in inherited) and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def run_profiled(prefix, function, *args):
+    # one profile per worker process, accumulated over the tasks it runs and rewritten after each of them
+    global worker_profiler
+    if worker_profiler is None:
+        worker_profiler = cProfile.Profile()
+        tracemalloc.start()
+    worker_profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        worker_profiler.disable()
+        write_profile(worker_profiler, f"{prefix}.worker-{os.getpid()}")
+
+
+def run_collected(function, *args):
+    # worker processes report what they measured back to the parent, which merges it
+    stop_inherited_profiles()
+    instrumentation.reset()
+    prefix = os.environ.get(PROFILE_VARIABLE)
+    result = run_profiled(prefix, function, *args) if prefix else function(*args)
+    return result, instrumentation.snapshot()
+
+
+def map_collected(executor, function, *iterables):
+    results = []
+    for result, snapshot in executor.map(run_collected, itertools.repeat(function), *iterables):
+        instrumentation.merge(snapshot)
+        results.append(result)
+    return results
+
+
+def write_profile(profiler, prefix, memory=True, top=25):
+    profiler.dump_stats(f"{prefix}.prof")
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(top)
+    with open(f"{prefix}.profile.txt", "w", encoding="utf-8") as f:
+        f.write(report.getvalue())
+    if memory and tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with open(f"{prefix}.tracemalloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"current {current} B, peak {peak} B\n")
+            f.writelines(f"{statistic}\n" for statistic in snapshot.statistics("lineno")[:top])
+
+
+@contextmanager
+def profile(prefix, memory=True, top=25):
+    profiler = cProfile.Profile()
+    entry = (os.getpid(), profiler, memory)
+    if memory:
+        tracemalloc.start()
+    active_profiles.append(entry)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        active_profiles.remove(entry)
+        write_profile(profiler, prefix, memory, top)
+        if memory:
+            tracemalloc.stop()
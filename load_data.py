@@ -1,22 +1,234 @@
 import csv
+import glob
+import io
+import json
+import os.path
 
+import numpy as np
 
-def load_dataset(path):
-    dataset = {
-            "Timestamp": [],
-            "CPU": [],
-            "Memory": [],
-            "Network": [],
-        }
-    with open(path, "r", encoding='utf-8') as f:
-        reader = csv.reader(f)
-        first_row = next(reader)
-        if len(first_row) != 4 or first_row[0] != "Timestamp" or first_row[1] != "CPU" or first_row[2] != "Memory" or first_row[3] != "Network":
+import instrumentation
+
+
+TIMESERIES_METRICS = ("CPU", "Memory", "Network")
+MANIFEST_NAME = "manifest.json"
+DATASET_COLUMNS = {
+    "Timestamp": ("timestamp", "timestamp [ms]", "timestamp [s]"),
+    "CPU": ("cpu", "cpu usage [%]", "cpu usage"),
+    "Memory": ("memory", "memory usage", "memory usage [kb]"),
+    "Network": ("network", "network received", "network received throughput [kb/s]"),
+}
+
+
+def detect_delimiter(header_line):
+    return ";" if header_line.count(";") > header_line.count(",") else ","
+
+
+def dataset_columns(headers):
+    headers = [header.strip().lower() for header in headers]
+    indexes = {}
+    for key, aliases in DATASET_COLUMNS.items():
+        for alias in aliases:
+            if alias in headers:
+                indexes[key] = headers.index(alias)
+                break
+        else:
             raise ValueError("Датасет повинен містити параметри: Timestamp, CPU, Memory, Network")
-        for row in reader:
-            dataset["Timestamp"].append(int(row[0]))
-            dataset["CPU"].append(float(row[1]))
-            dataset["Memory"].append(float(row[2]))
-            dataset["Network"].append(float(row[3]))
+    return indexes
+
+
+def dataset_cache_path(path):
+    return f"{path}.npy"
+
+
+def header_columns(header_line):
+    delimiter = detect_delimiter(header_line)
+    return delimiter, dataset_columns(next(csv.reader([header_line], delimiter=delimiter)))
+
+
+def parse_rows(text, delimiter, indexes):
+    if text.strip():
+        values = np.loadtxt(io.StringIO(text), delimiter=delimiter, usecols=list(indexes.values()), ndmin=2,
+                            dtype=np.float64)
+    else:
+        values = np.empty((0, len(indexes)), dtype=np.float64)
+    return {key: values[:, index] for index, key in enumerate(indexes)}
+
+
+def read_dataset(path):
+    with open(path, "rb") as f:
+        header = f.readline()
+        data = f.read()
+    delimiter, indexes = header_columns(header.decode("utf-8"))
+    # update resumes after the last line break, so the offset is recorded from the same bytes the rows come from
+    end = data.rfind(b"\n") + 1
+    columns = parse_rows(data[:end].decode("utf-8"), delimiter, indexes)
+    rows = len(columns["Timestamp"])
+    tail = data[end:].decode("utf-8")
+    if tail.strip():
+        # a file without a final line break still ends in a full row, while a row being written may not parse yet
+        try:
+            last = parse_rows(tail, delimiter, indexes)
+        except ValueError:
+            pass
+        else:
+            columns = {key: np.concatenate([columns[key], last[key]]) for key in columns}
+    return dataset_record(columns, len(header) + end, rows, bool(tail.strip()))
+
+
+def dataset_record(columns, offset, rows=None, tail=False):
+    length = len(columns["Timestamp"])
+    record = np.zeros((), dtype=[("Timestamp", np.int64, (length,)),
+                                 *((key, np.float64, (length,)) for key in TIMESERIES_METRICS),
+                                 ("Offset", np.int64), ("Rows", np.int64), ("Tail", np.bool_)])
+    for key in ("Timestamp", *TIMESERIES_METRICS):
+        record[key] = columns[key]
+    record["Offset"] = offset
+    record["Rows"] = length if rows is None else rows
+    record["Tail"] = tail
+    return record
+
+
+def save_dataset_cache(path, record):
+    cache_path = dataset_cache_path(path)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, record)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_dataset_record(path, cache=True):
+    cache_path = dataset_cache_path(path)
+    with instrumentation.phase("load_dataset"):
+        record = None
+        if cache and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            record = np.load(cache_path, mmap_mode="r")
+            # sidecars written before the offset was recorded are parsed again
+            if not {"Offset", "Rows", "Tail"} <= set(record.dtype.names):
+                record = None
+        if record is None:
+            record = read_dataset(path)
+            if cache:
+                try:
+                    save_dataset_cache(path, record)
+                except OSError:
+                    # e.g. a read-only trace directory: keep the parsed record, just without a sidecar
+                    pass
+                else:
+                    record = np.load(cache_path, mmap_mode="r")
+    instrumentation.count("dataset_rows", len(record["Timestamp"]))
+    return record
+
+
+def load_dataset(path, cache=True):
+    record = load_dataset_record(path, cache)
+    return {key: record[key] for key in ("Timestamp", *TIMESERIES_METRICS)}
+
+
+def read_appended_rows(path, offset=0):
+    with open(path, "rb") as f:
+        delimiter, indexes = header_columns(f.readline().decode("utf-8"))
+        # an offset inside the header or past the end means a fresh or rotated file
+        if offset < f.tell() or offset > os.fstat(f.fileno()).st_size:
+            offset = f.tell()
+        f.seek(offset)
+        data = f.read()
+
+    # a row that is still being written has no line break yet and is left for the next call
+    end = data.rfind(b"\n") + 1
+    rows = parse_rows(data[:end].decode("utf-8"), delimiter, indexes)
+    rows["Timestamp"] = rows["Timestamp"].astype(np.int64)
+    return rows, offset + end
+
+
+def csv_microservice(file):
+    return int(os.path.splitext(os.path.basename(file))[0])
+
+
+def timeseries_files(directory):
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        # a merged run lists exactly its own files, whatever else is left in the directory
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            files = [os.path.join(directory, file["Path"]) for file in json.load(f)["Files"]]
+        return sorted(files, key=csv_microservice) if all(file.endswith(".csv") for file in files) else files
+    return sorted(glob.glob(os.path.join(directory, "*.npz"))) or \
+        sorted(glob.glob(os.path.join(directory, "*.parquet"))) or \
+        sorted(glob.glob(os.path.join(directory, "*.csv")), key=csv_microservice)
+
+
+def iter_timeseries(path):
+    files = timeseries_files(path) if os.path.isdir(path) else [path]
+
+    for file in files:
+        extension = os.path.splitext(file)[1]
+        if extension == ".npz":
+            with np.load(file) as data:
+                yield {key: data[key] for key in data.files}
+        elif extension == ".parquet":
+            yield from iter_parquet_timeseries(file)
+        else:
+            values = np.loadtxt(file, delimiter=",", skiprows=1, dtype=np.int64, ndmin=2)
+            chunk = {"Microservice": np.array([int(os.path.splitext(os.path.basename(file))[0])]),
+                     "Timestamp": values[:, 0]}
+            for index, key in enumerate(TIMESERIES_METRICS):
+                chunk[key] = values[:, index + 1][None, :]
+            yield chunk
+
+
+def parquet_chunks(columns):
+    # a chunk is a run of microservices that share one block of timestamps
+    microservices, timestamps = columns["Microservice"], columns["Timestamp"]
+    if len(microservices) == 0:
+        return
+    starts = np.flatnonzero(np.r_[True, microservices[1:] != microservices[:-1]])
+    lengths = np.diff(np.r_[starts, len(microservices)])
+    groups = np.flatnonzero(np.r_[True, (lengths[1:] != lengths[:-1]) |
+                                  (timestamps[starts[1:]] != timestamps[starts[:-1]])])
+    for first, last in zip(groups, np.r_[groups[1:], len(starts)]):
+        start, length = starts[first], lengths[first]
+        end = start + (last - first) * length
+        chunk = {"Microservice": microservices[starts[first:last]], "Timestamp": timestamps[start:start + length]}
+        for key in TIMESERIES_METRICS:
+            chunk[key] = columns[key][start:end].reshape(last - first, length)
+        yield chunk
+
+
+def iter_parquet_timeseries(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet replay requires the pyarrow package") from e
+
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    pending = None
+    for row_group in range(parquet_file.num_row_groups):
+        table = parquet_file.read_row_group(row_group)
+        columns = {key: table.column(key).to_numpy() for key in ("Microservice", "Timestamp", *TIMESERIES_METRICS)}
+        if pending is not None:
+            columns = {key: np.concatenate([pending[key], values]) for key, values in columns.items()}
+        # the writer may split one series over two row groups, so the last one waits for the next group
+        microservices = columns["Microservice"]
+        if row_group + 1 < parquet_file.num_row_groups and len(microservices):
+            end = np.flatnonzero(np.r_[True, microservices[1:] != microservices[:-1]])[-1]
+            pending = {key: values[end:] for key, values in columns.items()}
+            columns = {key: values[:end] for key, values in columns.items()}
+        else:
+            pending = None
+        yield from parquet_chunks(columns)
+
 
-    return dataset
\ No newline at end of file
+def load_timeseries(path):
+    columns = {}
+    for chunk in iter_timeseries(path):
+        for row, microservice in enumerate(chunk["Microservice"].tolist()):
+            series = columns.setdefault(microservice, {key: [] for key in ("Timestamp", *TIMESERIES_METRICS)})
+            series["Timestamp"].append(chunk["Timestamp"])
+            for key in TIMESERIES_METRICS:
+                series[key].append(chunk[key][row])
+    return [{key: np.concatenate(values) for key, values in columns[microservice].items()}
+            for microservice in sorted(columns)]
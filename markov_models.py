@@ -0,0 +1,355 @@
+import numpy as np
+
+from load_data import TIMESERIES_METRICS as METRICS
+
+
+DENSE_ANALYSIS_LIMIT = 2048
+
+
+def matrix_power(powers, n):
+    # powers caches P^(2^k); extend it on demand and combine the set bits of n
+    if n < 0:
+        raise ValueError("n must be non-negative")
+    result = None
+    bit = 0
+    while n >> bit:
+        if bit == len(powers):
+            powers.append(powers[-1] @ powers[-1])
+        if (n >> bit) & 1:
+            result = powers[bit] if result is None else result @ powers[bit]
+        bit += 1
+    if result is None:
+        result = np.broadcast_to(np.eye(powers[0].shape[-1]), powers[0].shape).copy()
+    return result
+
+
+def sample_distribution(distribution, uniforms):
+    cumulative = np.cumsum(distribution, axis=-1)
+    cumulative[..., -1] = 1.0
+    if cumulative.ndim == 1:
+        return np.searchsorted(cumulative, uniforms, side="right")
+    return np.stack([np.searchsorted(row, row_uniforms, side="right")
+                     for row, row_uniforms in zip(cumulative, uniforms)])
+
+
+def alias_tables(probabilities):
+    # Vose's alias method for every row of a (..., states) probability array
+    rows = probabilities.reshape(-1, probabilities.shape[-1])
+    states = rows.shape[1]
+    probability = np.zeros(rows.shape, dtype=np.float64)
+    alias = np.zeros(rows.shape, dtype=np.int64)
+    for index, row in enumerate(rows):
+        scaled = row * states
+        small = [i for i in range(states) if scaled[i] < 1.0]
+        large = [i for i in range(states) if scaled[i] >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probability[index, less] = scaled[less]
+            alias[index, less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        for i in small + large:
+            probability[index, i] = 1.0
+            alias[index, i] = i
+    return probability.reshape(probabilities.shape), alias.reshape(probabilities.shape)
+
+
+class DenseMarkovModel:
+    chains = len(METRICS)
+
+    def __init__(self, transition_matrix, tolerance=1e-6):
+        if isinstance(transition_matrix, dict):
+            transition_matrix = [transition_matrix[key] for key in METRICS]
+        try:
+            matrices = np.array(transition_matrix, dtype=np.float64)
+        except ValueError:
+            raise ValueError("Неправильна конфігурація. Матриці мають бути квадратними.")
+        if matrices.ndim != 3 or matrices.shape[0] != len(METRICS) or matrices.shape[1] != matrices.shape[2]:
+            raise ValueError("Неправильна конфігурація. Матриці мають бути квадратними.")
+        if (matrices < 0).any():
+            raise ValueError("Неправильна конфігурація. Ймовірності не можуть бути від'ємними.")
+        sums = matrices.sum(axis=2, keepdims=True)
+        if (np.abs(sums - 1) > tolerance).any():
+            raise ValueError('Неправильна конфігурація. Сума ймовірностей кожного рядка повинна бути рівною 1.')
+
+        self.__matrices = np.ascontiguousarray(matrices / sums)
+        self.__matrices.flags.writeable = False
+        self.__cumulative = None
+        self.__alias = None
+        self.__powers = [self.__matrices]
+        self.__stationary = None
+
+    @property
+    def states(self):
+        return self.__matrices.shape[1]
+
+    @property
+    def matrices(self):
+        return self.__matrices
+
+    @property
+    def cumulative(self):
+        if self.__cumulative is None:
+            cumulative = np.cumsum(self.__matrices, axis=2)
+            cumulative[:, :, -1] = 1.0
+            self.__cumulative = cumulative
+        return self.__cumulative
+
+    @property
+    def alias(self):
+        if self.__alias is None:
+            self.__alias = alias_tables(self.__matrices)
+        return self.__alias
+
+    def initial_states_from(self, uniforms):
+        states = np.minimum((uniforms[0] * self.states).astype(np.int64), self.states - 1)
+        return np.repeat(states[None, :], len(METRICS), axis=0)
+
+    @staticmethod
+    def metric_states(current_states):
+        return current_states
+
+    def next_states(self, current_states, uniforms):
+        probability, alias = self.alias
+        metric_index = np.arange(len(METRICS))[:, None]
+        scaled = uniforms * self.states
+        candidates = np.minimum(scaled.astype(np.int64), self.states - 1)
+        accept = (scaled - candidates) < probability[metric_index, current_states, candidates]
+        return np.where(accept, candidates, alias[metric_index, current_states, candidates])
+
+    def initial_distribution(self):
+        return np.full((len(METRICS), self.states), 1 / self.states)
+
+    def stationary(self):
+        if self.__stationary is None:
+            stationary = np.empty((len(METRICS), self.states))
+            for index, matrix in enumerate(self.__matrices):
+                eigenvalues, eigenvectors = np.linalg.eig(matrix.T)
+                vector = np.abs(np.real(eigenvectors[:, np.argmin(np.abs(eigenvalues - 1))]))
+                stationary[index] = vector / vector.sum()
+            self.__stationary = stationary
+        return self.__stationary
+
+    def n_step(self, n):
+        return matrix_power(self.__powers, n)
+
+    def distribution_after(self, distribution, n):
+        return np.einsum("ms,mst->mt", distribution, self.n_step(n))
+
+    @staticmethod
+    def marginals(distribution):
+        return distribution
+
+    @staticmethod
+    def sample_states_from(distribution, uniforms):
+        return sample_distribution(distribution, uniforms)
+
+    def to_dict(self):
+        return {key: self.__matrices[index] for index, key in enumerate(METRICS)}
+
+    def save(self, path, bins=None):
+        arrays = {"Matrices": self.__matrices}
+        if bins is not None:
+            arrays["Bins"] = np.array([bins[key] for key in METRICS], dtype=np.float64).reshape(len(METRICS), -1)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls(data["Matrices"])
+            bins = {key: data["Bins"][index].tolist() for index, key in enumerate(METRICS)} \
+                if "Bins" in data.files else None
+        return model, bins
+
+
+def encode_joint_states(metric_states, states):
+    joint = np.zeros(np.shape(metric_states)[1], dtype=np.int64)
+    for state_index in metric_states:
+        joint = joint * states + state_index
+    return joint
+
+
+def joint_states(dataset, states, bins):
+    return encode_joint_states([np.digitize(dataset[key], bins[key]) for key in METRICS], states)
+
+
+def count_joint_transitions(joint, states):
+    # only observed transitions; a state the trace ends in is given a successor by SparseJointModel.from_counts
+    transitions, counts = np.unique(joint[:-1] * states ** len(METRICS) + joint[1:], return_counts=True)
+    return {"Transitions": transitions, "Counts": counts}
+
+
+def merge_joint_counts(joint_counts):
+    joint_counts = list(joint_counts)
+    if not joint_counts:
+        return {"Transitions": np.empty(0, dtype=np.int64), "Counts": np.empty(0, dtype=np.int64)}
+    transitions, inverse = np.unique(np.concatenate([counts["Transitions"] for counts in joint_counts]),
+                                     return_inverse=True)
+    weights = np.concatenate([counts["Counts"] for counts in joint_counts])
+    counts = np.bincount(inverse, weights=weights, minlength=len(transitions))
+    return {"Transitions": transitions, "Counts": counts.astype(weights.dtype)}
+
+
+class SparseJointModel:
+    chains = 1
+
+    def __init__(self, states, observed, indptr, indices, probabilities, initial):
+        self.__states = int(states)
+        self.__observed = np.ascontiguousarray(observed, dtype=np.int64)
+        self.__indptr = np.ascontiguousarray(indptr, dtype=np.int64)
+        self.__indices = np.ascontiguousarray(indices, dtype=np.int64)
+        self.__probabilities = np.ascontiguousarray(probabilities, dtype=np.float64)
+        self.__initial = np.ascontiguousarray(initial, dtype=np.float64)
+        if len(self.__observed) == 0:
+            raise ValueError("Неправильна конфігурація. Модель не містить жодного стану.")
+        if len(self.__indptr) != len(self.__observed) + 1 or self.__indptr[-1] != len(self.__indices) or \
+                len(self.__probabilities) != len(self.__indices) or len(self.__initial) != len(self.__observed):
+            raise ValueError("Неправильна конфігурація. Розреджена матриця переходів пошкоджена.")
+        lengths = np.diff(self.__indptr)
+        if (lengths < 1).any():
+            raise ValueError("Неправильна конфігурація. Кожен стан повинен мати хоча б один перехід.")
+        rows = np.repeat(np.arange(len(self.__observed)), lengths)
+        if not np.allclose(np.bincount(rows, weights=self.__probabilities, minlength=len(self.__observed)), 1,
+                           atol=1e-6):
+            raise ValueError('Неправильна конфігурація. Сума ймовірностей кожного рядка повинна бути рівною 1.')
+
+        # shifting each row's CDF by its row index makes one sorted array searchable for every row at once
+        cumulative = np.cumsum(self.__probabilities)
+        row_offsets = np.r_[0.0, cumulative[self.__indptr[1:-1] - 1]]
+        self.__rows = rows
+        self.__cumulative = rows + cumulative - np.repeat(row_offsets, lengths)
+        self.__cumulative[self.__indptr[1:] - 1] = np.arange(1, len(self.__observed) + 1)
+        self.__initial_cumulative = np.cumsum(self.__initial / self.__initial.sum())
+        self.__initial_cumulative[-1] = 1.0
+        divisors = self.__states ** np.arange(len(METRICS) - 1, -1, -1)
+        self.__metric_states = (self.__observed[None, :] // divisors[:, None]) % self.__states
+        self.__powers = None
+        self.__stationary = None
+
+    @classmethod
+    def from_counts(cls, states, transitions, counts):
+        joint_states_count = states ** len(METRICS)
+        previous, following = np.divmod(np.asarray(transitions, dtype=np.int64), joint_states_count)
+        observed = np.union1d(previous, following)
+        rows = np.searchsorted(observed, previous)
+        row_totals = np.bincount(rows, weights=counts, minlength=len(observed))
+        # states that were only ever reached (never left) keep themselves as their only successor
+        dead_ends = np.flatnonzero(row_totals == 0)
+        if len(dead_ends):
+            rows = np.r_[rows, dead_ends]
+            following = np.r_[following, observed[dead_ends]]
+            counts = np.r_[counts, np.ones(len(dead_ends))]
+            order = np.lexsort((following, rows))
+            rows, following, counts = rows[order], following[order], counts[order]
+            row_totals = np.bincount(rows, weights=counts, minlength=len(observed))
+        indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=len(observed)))]
+        return cls(states, observed, indptr, np.searchsorted(observed, following), counts / row_totals[rows],
+                   row_totals)
+
+    @property
+    def states(self):
+        return self.__states
+
+    @property
+    def observed_states(self):
+        return len(self.__observed)
+
+    @property
+    def nnz(self):
+        return len(self.__indices)
+
+    def initial_states_from(self, uniforms):
+        return np.searchsorted(self.__initial_cumulative, uniforms[0], side="right")
+
+    def metric_states(self, current_states):
+        return self.__metric_states[:, current_states]
+
+    def next_states(self, current_states, uniforms):
+        positions = np.searchsorted(self.__cumulative, current_states + uniforms[0], side="right")
+        return self.__indices[positions]
+
+    def __step_distribution(self, distribution):
+        return np.bincount(self.__indices, weights=distribution[self.__rows] * self.__probabilities,
+                           minlength=len(self.__observed))
+
+    def dense_matrix(self):
+        if len(self.__observed) > DENSE_ANALYSIS_LIMIT:
+            raise ValueError(f"dense analysis is limited to {DENSE_ANALYSIS_LIMIT} observed states")
+        matrix = np.zeros((len(self.__observed), len(self.__observed)))
+        np.add.at(matrix, (self.__rows, self.__indices), self.__probabilities)
+        return matrix
+
+    def initial_distribution(self):
+        return self.__initial / self.__initial.sum()
+
+    def stationary(self, tolerance=1e-12, max_iterations=100000):
+        if self.__stationary is None:
+            # the lazy chain (P + I) / 2 has the same stationary distribution and also converges for periodic chains
+            distribution = self.initial_distribution()
+            for _ in range(max_iterations):
+                following = 0.5 * (distribution + self.__step_distribution(distribution))
+                converged = np.abs(following - distribution).sum() < tolerance
+                distribution = following
+                if converged:
+                    break
+            self.__stationary = distribution / distribution.sum()
+        return self.__stationary
+
+    def n_step(self, n):
+        if self.__powers is None:
+            self.__powers = [self.dense_matrix()]
+        return matrix_power(self.__powers, n)
+
+    def distribution_after(self, distribution, n, tolerance=1e-12):
+        if len(self.__observed) <= DENSE_ANALYSIS_LIMIT:
+            return distribution @ self.n_step(n)
+        for _ in range(n):
+            following = self.__step_distribution(distribution)
+            converged = np.abs(following - distribution).sum() < tolerance
+            distribution = following
+            if converged:
+                break
+        return distribution
+
+    def marginals(self, distribution):
+        return np.stack([np.bincount(states, weights=distribution, minlength=self.__states)
+                         for states in self.__metric_states])
+
+    @staticmethod
+    def sample_states_from(distribution, uniforms):
+        return sample_distribution(distribution, uniforms[0])
+
+    def to_dict(self):
+        return {"States": np.int64(self.__states), "Observed": self.__observed, "Indptr": self.__indptr,
+                "Indices": self.__indices, "Probabilities": self.__probabilities, "Initial": self.__initial}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(np.asarray(data["States"])), data["Observed"], data["Indptr"], data["Indices"],
+                   data["Probabilities"], data["Initial"])
+
+    def save(self, path, bins=None):
+        arrays = self.to_dict()
+        if bins is not None:
+            arrays["Bins"] = np.array([bins[key] for key in METRICS], dtype=np.float64).reshape(len(METRICS), -1)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls.from_dict(data)
+            bins = {key: data["Bins"][index].tolist() for index, key in enumerate(METRICS)} \
+                if "Bins" in data.files else None
+        return model, bins
+
+
+def model_from_dict(data):
+    if "Observed" in data:
+        return SparseJointModel.from_dict(data)
+    return DenseMarkovModel(data)
+
+
+def load_model(path):
+    with np.load(path) as data:
+        joint = "Observed" in data.files
+    return SparseJointModel.load(path) if joint else DenseMarkovModel.load(path)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+class ModelCache:
+    def __init__(self, directory=".model_cache", max_entries=16):
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive")
+        self.__directory = directory
+        self.__max_entries = max_entries
+        self.__index_path = os.path.join(directory, "index.json")
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    @staticmethod
+    def key(dataset_path, states, bins, joint=False):
+        stat = os.stat(dataset_path)
+        payload = json.dumps({
+            "DatasetPath": os.path.abspath(dataset_path),
+            "Size": stat.st_size,
+            "MTime": stat.st_mtime_ns,
+            "States": states,
+            "Bins": bins,
+            "Joint": joint,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __entry_path(self, key):
+        return os.path.join(self.__directory, f"{key}.npz")
+
+    def __load_index(self):
+        try:
+            with open(self.__index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def __save_index(self, index):
+        tmp_path = f"{self.__index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.__index_path)
+
+    def get(self, key):
+        path = self.__entry_path(key)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as data:
+            transition_matrix = {name: data[name] for name in data.files}
+        index = self.__load_index()
+        index[key] = time.time()
+        self.__save_index(index)
+        return transition_matrix
+
+    def put(self, key, transition_matrix):
+        os.makedirs(self.__directory, exist_ok=True)
+        tmp_path = os.path.join(self.__directory, f"{key}.tmp.npz")
+        np.savez(tmp_path, **{name: np.asarray(matrix) for name, matrix in transition_matrix.items()})
+        os.replace(tmp_path, self.__entry_path(key))
+
+        index = self.__load_index()
+        index[key] = time.time()
+        for stale_key in sorted(index, key=index.get)[:max(0, len(index) - self.__max_entries)]:
+            del index[stale_key]
+            try:
+                os.remove(self.__entry_path(stale_key))
+            except FileNotFoundError:
+                pass
+        self.__save_index(index)
+
+    def clear(self):
+        for key in self.__load_index():
+            try:
+                os.remove(self.__entry_path(key))
+            except FileNotFoundError:
+                pass
+        self.__save_index({})
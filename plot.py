@@ -1,34 +1,98 @@
 import matplotlib
 import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
+
+import instrumentation
 
 
 matplotlib.use("TkAgg")
 
 
-def plot_dataset(dataset):
-    df = pd.DataFrame(dataset)
+PLOT_METRICS = (
+    ("CPU", "CPU Usage (%)"),
+    ("Memory", "Memory Usage (%)"),
+    ("Network", "Network Usage (units)"),
+)
+MARKER_LIMIT = 500
+
+
+def minmax_decimate(x, y, points):
+    # keep the minimum and the maximum of every bucket, so peaks survive decimation
+    buckets = points // 2
+    if buckets < 1 or len(y) <= points:
+        return x, y
+    size = len(y) // buckets
+    body = np.asarray(y[:size * buckets]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    indexes = np.concatenate([offsets + body.argmin(axis=1), offsets + body.argmax(axis=1)])
+    if len(y) > size * buckets:
+        tail = np.asarray(y[size * buckets:])
+        indexes = np.concatenate([indexes, size * buckets + np.array([tail.argmin(), tail.argmax()])])
+    indexes = np.unique(indexes)
+    return x[indexes], y[indexes]
+
+
+def lttb_decimate(x, y, points):
+    # Largest-Triangle-Three-Buckets: keeps the point of each bucket that spans the largest triangle
+    if points < 3 or len(y) <= points:
+        return x, y
+    xf = np.asarray(x, dtype=np.float64)
+    yf = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, len(y) - 1, points - 1).astype(np.int64)
+    indexes = np.empty(points, dtype=np.int64)
+    indexes[0], indexes[-1] = 0, len(y) - 1
+    selected = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        following_end = edges[bucket + 2] if bucket + 2 < len(edges) else len(y)
+        average_x = xf[end:following_end].mean() if following_end > end else xf[-1]
+        average_y = yf[end:following_end].mean() if following_end > end else yf[-1]
+        areas = np.abs((xf[selected] - average_x) * (yf[start:end] - yf[selected]) -
+                       (xf[selected] - xf[start:end]) * (average_y - yf[selected]))
+        selected = start + int(areas.argmax())
+        indexes[bucket + 1] = selected
+    return x[indexes], y[indexes]
+
+
+def decimate(x, y, points=2000, method="minmax"):
+    if method == "minmax":
+        return minmax_decimate(x, y, points)
+    if method == "lttb":
+        return lttb_decimate(x, y, points)
+    raise ValueError("method must be 'minmax' or 'lttb'")
+
+
+def plot_series(series, labels=None, points=2000, method="minmax", title='Time Series of Individual Parameters',
+                show=True):
+    if isinstance(series, dict):
+        series = [series]
+    labels = labels or ([None] if len(series) == 1 else [str(i + 1) for i in range(len(series))])
 
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='s')
+    with instrumentation.phase("plot"):
+        fig, axes = plt.subplots(nrows=3, ncols=1, figsize=(12, 10), sharex=True)
+        fig.suptitle(title)
 
-    fig, axes = plt.subplots(nrows=3, ncols=1, figsize=(12, 10), sharex=True)
-    fig.suptitle('Time Series of Individual Parameters')
+        for timeseries, label in zip(series, labels):
+            timestamps = np.asarray(timeseries['Timestamp'])
+            for axis, (key, ylabel) in zip(axes, PLOT_METRICS):
+                x, y = decimate(timestamps, np.asarray(timeseries[key]), points, method)
+                instrumentation.count("plotted_points", len(y))
+                # TODO тут неправильно переводиться час по utc
+                x = x.astype('datetime64[s]')
+                style = {"marker": 'o', "markersize": 3} if len(y) <= MARKER_LIMIT else {}
+                axis.plot(x, y, label=label or key, linestyle='-', linewidth=0.5, **style)
 
-    axes[0].plot(df['Timestamp'], df['CPU'], label='CPU', marker='o', linestyle='-')
-    axes[0].set_ylabel('CPU Usage (%)')
-    axes[0].legend()
-    axes[0].grid(True)
+        for axis, (key, ylabel) in zip(axes, PLOT_METRICS):
+            axis.set_ylabel(ylabel)
+            axis.legend()
+            axis.grid(True)
+        axes[-1].set_xlabel('Timestamp')
 
-    axes[1].plot(df['Timestamp'], df['Memory'], label='Memory', marker='o', linestyle='-')
-    axes[1].set_ylabel('Memory Usage (%)')
-    axes[1].legend()
-    axes[1].grid(True)
+        plt.tight_layout(rect=(0.0, 0.03, 1.0, 0.95))
+    if show:
+        plt.show()
+    return fig
 
-    axes[2].plot(df['Timestamp'], df['Network'], label='Network', marker='o', linestyle='-')
-    axes[2].set_ylabel('Network Usage (units)')
-    axes[2].set_xlabel('Timestamp')
-    axes[2].legend()
-    axes[2].grid(True)
 
-    plt.tight_layout(rect=(0.0, 0.03, 1.0, 0.95))
-    plt.show()
\ No newline at end of file
+def plot_dataset(dataset, points=2000, method="minmax"):
+    return plot_series(dataset, points=points, method=method)
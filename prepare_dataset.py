@@ -1,26 +1,190 @@
+import argparse
 import csv
+import glob
+import hashlib
+import json
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+import numpy as np
 
-path = "datasets/workload_dataset/dataset.csv"
+import load_data
 
 
-data = []
+TRACE_COLUMNS = {
+    "Timestamp": load_data.DATASET_COLUMNS["Timestamp"],
+    "CPU": ("cpu usage [%]", "cpu usage"),
+    "CPUUsage": ("cpu usage [mhz]",),
+    "CPUCapacity": ("cpu capacity provisioned [mhz]",),
+    "Memory": ("memory usage [kb]", "memory usage"),
+    "MemoryCapacity": ("memory capacity provisioned [kb]",),
+    "Network": ("network received throughput [kb/s]", "network received"),
+}
+AGGREGATES = ("mean", "max")
 
 
-with open(path, "r", encoding="utf-8") as f:
-    reader = csv.reader(f, delimiter=";")
-    headers = next(reader)
-    indexes = []
-    for i in range(len(headers)):
-        if headers[i].lower() in ("timestamp", "cpu usage", "memory usage", "network received", "network transmitted"):
-            indexes.append(i)
+def trace_columns(headers):
+    headers = [header.strip().lower() for header in headers]
+    indexes = {}
+    for key, aliases in TRACE_COLUMNS.items():
+        found = [headers.index(alias) for alias in aliases if alias in headers]
+        if found:
+            indexes[key] = found[0]
+    has_cpu = "CPU" in indexes or ("CPUUsage" in indexes and "CPUCapacity" in indexes)
+    if not has_cpu or any(key not in indexes for key in ("Timestamp", "Memory", "MemoryCapacity", "Network")):
+        raise ValueError("Датасет повинен містити параметри: Timestamp, CPU usage, Memory usage, "
+                         "Memory capacity provisioned, Network received")
+    return indexes
 
-    data.append([headers[i] for i in indexes])
 
-    for row in reader:
-        data.append([row[i] for i in indexes])
+def read_trace(path):
+    with open(path, "r", encoding="utf-8") as f:
+        header_line = f.readline()
+        delimiter = load_data.detect_delimiter(header_line)
+        indexes = trace_columns(next(csv.reader([header_line], delimiter=delimiter)))
+        values = np.loadtxt(f, delimiter=delimiter, usecols=list(indexes.values()), ndmin=2, dtype=np.float64)
+    return {key: values[:, index] for index, key in enumerate(indexes)}
 
 
-with open("datasets/workload_dataset/workload.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f, delimiter=",")
-    writer.writerows(data)
\ No newline at end of file
+def percent_of(usage, capacity):
+    capacity = np.broadcast_to(np.asarray(capacity, dtype=np.float64), usage.shape)
+    share = np.divide(usage, capacity, out=np.zeros_like(usage), where=capacity > 0)
+    return np.clip(share * 100, 0, 100)
+
+
+def normalize_trace(trace, network_capacity=None):
+    order = np.argsort(trace["Timestamp"], kind="stable")
+    trace = {key: values[order] for key, values in trace.items()}
+    if "CPU" in trace:
+        cpu = np.clip(trace["CPU"], 0, 100)
+    else:
+        cpu = percent_of(trace["CPUUsage"], trace["CPUCapacity"])
+    # Bitbrains traces carry no provisioned bandwidth, so the trace's own peak stands in for it
+    network_capacity = network_capacity or (trace["Network"].max() if len(trace["Network"]) else 0)
+    return {
+        "Timestamp": trace["Timestamp"].astype(np.int64),
+        "CPU": cpu,
+        "Memory": percent_of(trace["Memory"], trace["MemoryCapacity"]),
+        "Network": percent_of(trace["Network"], network_capacity),
+    }
+
+
+def resample(dataset, step, aggregate="mean"):
+    if step < 1:
+        raise ValueError("step must be positive")
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"aggregate must be one of {', '.join(AGGREGATES)}")
+    timestamps = np.asarray(dataset["Timestamp"], dtype=np.int64)
+    if len(timestamps) == 0:
+        return {key: np.asarray(values) for key, values in dataset.items()}
+
+    buckets = timestamps // step
+    first = buckets[0]
+    buckets = buckets - first
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    observed = buckets[starts]
+    lengths = np.diff(np.r_[starts, len(buckets)])
+    # empty buckets (gaps, or a step finer than the trace) carry the last observed value forward
+    filled = np.zeros(observed[-1] + 1, dtype=np.int64)
+    filled[observed] = np.arange(len(observed))
+    filled = np.maximum.accumulate(filled)
+
+    resampled = {"Timestamp": (first + np.arange(len(filled))) * step}
+    for key in load_data.TIMESERIES_METRICS:
+        values = np.asarray(dataset[key], dtype=np.float64)
+        if aggregate == "mean":
+            values = np.add.reduceat(values, starts) / lengths
+        else:
+            values = np.maximum.reduceat(values, starts)
+        resampled[key] = values[filled]
+    return resampled
+
+
+def write_prepared(path, dataset):
+    block = np.column_stack([dataset["Timestamp"], *(dataset[key] for key in load_data.TIMESERIES_METRICS)])
+    row_format = ",".join(["%d"] + ["%.2f"] * len(load_data.TIMESERIES_METRICS)) + "\n"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        f.write(",".join(["Timestamp", *load_data.TIMESERIES_METRICS]) + "\n")
+        f.write((row_format * len(block)) % tuple(block.ravel().tolist()))
+    # the rounded values are what a later read of the CSV would produce
+    rounded = {key: np.round(dataset[key], 2) for key in load_data.TIMESERIES_METRICS}
+    load_data.save_dataset_cache(path, load_data.dataset_record({"Timestamp": dataset["Timestamp"], **rounded},
+                                                                os.path.getsize(path)))
+
+
+def prepare_file(path, output_path, step=300, aggregate="mean", network_capacity=None):
+    dataset = resample(normalize_trace(read_trace(path), network_capacity), step, aggregate)
+    write_prepared(output_path, dataset)
+    return len(dataset["Timestamp"])
+
+
+def prepare_key(path, step, aggregate, network_capacity):
+    stat = os.stat(path)
+    payload = json.dumps({
+        "DatasetPath": os.path.abspath(path),
+        "Size": stat.st_size,
+        "MTime": stat.st_mtime_ns,
+        "Step": step,
+        "Aggregate": aggregate,
+        "NetworkCapacity": network_capacity,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prepare_directory(source="datasets/workload_dataset", destination="datasets/prepared", step=300, aggregate="mean",
+                      network_capacity=None, pattern="[0-9]*.csv", workers=None):
+    paths = sorted(glob.glob(os.path.join(source, pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No dataset files matching {pattern} in {source}")
+    os.makedirs(destination, exist_ok=True)
+    index_path = os.path.join(destination, "index.json")
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        index = {}
+
+    outputs = [os.path.join(destination, os.path.basename(path)) for path in paths]
+    keys = [prepare_key(path, step, aggregate, network_capacity) for path in paths]
+    stale = [i for i, (output, key) in enumerate(zip(outputs, keys))
+             if index.get(os.path.basename(output)) != key or not os.path.isfile(output)]
+    stale_paths, stale_outputs = [paths[i] for i in stale], [outputs[i] for i in stale]
+    if workers == 1 or len(stale) < 2:
+        list(map(prepare_file, stale_paths, stale_outputs, repeat(step), repeat(aggregate), repeat(network_capacity)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(prepare_file, stale_paths, stale_outputs, repeat(step), repeat(aggregate),
+                              repeat(network_capacity)))
+
+    for i in stale:
+        index[os.path.basename(outputs[i])] = keys[i]
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return outputs, len(stale)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize raw traces to percent of capacity and resample them.")
+    parser.add_argument("source", nargs="?", default="datasets/workload_dataset")
+    parser.add_argument("destination", nargs="?", default="datasets/prepared")
+    parser.add_argument("--step", type=int, default=300, help="target sampling step in seconds")
+    parser.add_argument("--aggregate", choices=AGGREGATES, default="mean")
+    parser.add_argument("--network-capacity", type=float, default=None,
+                        help="provisioned network throughput in KB/s, defaults to each trace's peak")
+    parser.add_argument("--pattern", default="[0-9]*.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    outputs, prepared = prepare_directory(args.source, args.destination, args.step, args.aggregate,
+                                          args.network_capacity, args.pattern, args.workers)
+    print(f"Prepared {prepared} of {len(outputs)} trace(s) -> {args.destination}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+WORD_MASK = 0xFFFFFFFF
+PHILOX_MULTIPLIERS = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+PHILOX_WEYL = (0x9E3779B9, 0xBB67AE85)
+PHILOX_ROUNDS = 10
+# blocks hashed per pass, small enough for the round temporaries to stay in cache
+PHILOX_BATCH = 1 << 14
+
+
+def seed_sequence(seed):
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def stream_key(seed):
+    return tuple(int(word) for word in seed_sequence(seed).generate_state(2, np.uint32))
+
+
+def philox_rounds(x0, x1, x2, x3, key):
+    k0, k1 = key
+    p0, p1 = np.empty_like(x0), np.empty_like(x0)
+    shift, mask = np.uint64(32), np.uint64(WORD_MASK)
+    for _ in range(PHILOX_ROUNDS):
+        np.multiply(x0, PHILOX_MULTIPLIERS[0], out=p0)
+        np.multiply(x2, PHILOX_MULTIPLIERS[1], out=p1)
+        np.right_shift(p1, shift, out=x0)
+        x0 ^= x1
+        x0 ^= np.uint64(k0)
+        np.right_shift(p0, shift, out=x2)
+        x2 ^= x3
+        x2 ^= np.uint64(k1)
+        np.bitwise_and(p1, mask, out=x1)
+        np.bitwise_and(p0, mask, out=x3)
+        k0, k1 = (k0 + PHILOX_WEYL[0]) & WORD_MASK, (k1 + PHILOX_WEYL[1]) & WORD_MASK
+
+
+def philox4x32(counter, key):
+    # Philox4x32-10 (Salmon et al., SC'11) maps a 128-bit counter to four random 32-bit words, so any block of any
+    # stream is computed directly and a whole fleet is hashed in one vectorized pass
+    words = np.empty((4,) + np.broadcast_shapes(*(np.shape(word) for word in counter)), dtype=np.uint64)
+    for index, word in enumerate(counter):
+        words[index] = word
+    flat = words.reshape(4, -1)
+    for start in range(0, flat.shape[1], PHILOX_BATCH):
+        philox_rounds(*flat[:, start:start + PHILOX_BATCH], key)
+    return words
+
+
+def microservice_uniforms(key, microservices, first_step, steps, width):
+    # every microservice owns a stream keyed by its id: word w of microservice m is lane w % 4 of block (w // 4, m),
+    # and step t consumes words [t * width, (t + 1) * width), so any split of the fleet reproduces the same series
+    ids = np.asarray(microservices, dtype=np.uint64)
+    first_word, last_word = first_step * width, (first_step + steps) * width
+    blocks = np.arange(first_word // 4, -(-last_word // 4), dtype=np.uint64)[:, None]
+    words = philox4x32((blocks & np.uint64(WORD_MASK), blocks >> np.uint64(32), ids & np.uint64(WORD_MASK),
+                        ids >> np.uint64(32)), key)
+    uniforms = np.empty((len(blocks), 4, len(ids)))
+    np.add(words.transpose(1, 0, 2), 0.5, out=uniforms)
+    uniforms *= 2.0 ** -32
+    offset = first_word % 4
+    return uniforms.reshape(4 * len(blocks), len(ids))[offset:offset + steps * width].reshape(steps, width, len(ids))
+
+
+def microservice_normals(key, microservices, first_step, steps, width):
+    # Box-Muller on pairs of uniforms; the uniforms are never 0, so the logarithm is finite
+    uniforms = microservice_uniforms(key, microservices, first_step, steps, 2 * -(-width // 2))
+    radius = np.sqrt(-2 * np.log(uniforms[:, 0::2]))
+    angle = 2 * np.pi * uniforms[:, 1::2]
+    return np.concatenate([radius * np.cos(angle), radius * np.sin(angle)], axis=1)[:, :width]
@@ -0,0 +1,177 @@
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from workload_generator import MarkovChain
+
+
+SAMPLE_FORMAT = '{"Microservice": %d, "Timestamp": %.3f, "CPU": %d, "Memory": %d, "Network": %d}\n'
+
+
+class StdoutSink:
+    def __init__(self, stream=None):
+        self.__stream = stream or sys.stdout
+
+    async def open(self):
+        pass
+
+    async def send(self, payload):
+        self.__stream.write(payload)
+        self.__stream.flush()
+
+    async def close(self):
+        pass
+
+
+class FileSink:
+    def __init__(self, path):
+        self.__path = path
+        self.__file = None
+
+    async def open(self):
+        # opening a FIFO blocks until a reader attaches, so keep it off the event loop
+        self.__file = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: open(self.__path, "a", encoding="utf-8"))
+
+    async def send(self, payload):
+        self.__file.write(payload)
+        self.__file.flush()
+
+    async def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class UDPSink:
+    def __init__(self, host, port):
+        self.__address = (host, port)
+        self.__transport = None
+
+    async def open(self):
+        self.__transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=self.__address)
+
+    async def send(self, payload):
+        for line in payload.splitlines(keepends=True):
+            self.__transport.sendto(line.encode("utf-8"))
+
+    async def close(self):
+        if self.__transport is not None:
+            self.__transport.close()
+            self.__transport = None
+
+
+class TCPSink:
+    def __init__(self, host, port):
+        self.__address = (host, port)
+        self.__writer = None
+
+    async def open(self):
+        _, self.__writer = await asyncio.open_connection(*self.__address)
+
+    async def send(self, payload):
+        self.__writer.write(payload.encode("utf-8"))
+        await self.__writer.drain()
+
+    async def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+            await self.__writer.wait_closed()
+            self.__writer = None
+
+
+class Replayer:
+    def __init__(self, markov_chain: MarkovChain, sinks, step=1.0, count=1, prefetch=64, spin=0.001):
+        if step <= 0:
+            raise ValueError("step must be positive")
+        self.__markov_chain = markov_chain
+        self.__sinks = list(sinks)
+        self.__step = step
+        self.__count = count
+        self.__prefetch = prefetch
+        self.__spin = spin
+        self.__running = False
+        self.__ticks = 0
+        self.__last_lateness = 0.0
+        self.__max_lateness = 0.0
+        self.__total_lateness = 0.0
+        self.on_tick = None
+
+    @property
+    def ticks(self):
+        return self.__ticks
+
+    @property
+    def last_lateness(self):
+        return self.__last_lateness
+
+    @property
+    def max_lateness(self):
+        return self.__max_lateness
+
+    @property
+    def mean_lateness(self):
+        return self.__total_lateness / self.__ticks if self.__ticks else 0.0
+
+    def stop(self):
+        self.__running = False
+
+    def __samples(self):
+        chunks = self.__markov_chain.iter_generate(0, 2 ** 62, 1, self.__count, self.__prefetch)
+        for chunk in chunks:
+            columns = np.stack([chunk[key] for key in MarkovChain.METRICS], axis=2)
+            yield from np.swapaxes(columns, 0, 1)
+
+    def __format(self, timestamp, values):
+        microservices = range(1, self.__count + 1)
+        return "".join(SAMPLE_FORMAT % (microservice, timestamp, *row)
+                       for microservice, row in zip(microservices, values.tolist()))
+
+    async def __wait(self, loop, deadline):
+        delay = deadline - loop.time() - self.__spin
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while loop.time() < deadline:
+            await asyncio.sleep(0)
+
+    async def run(self, ticks=None):
+        loop = asyncio.get_running_loop()
+        for sink in self.__sinks:
+            await sink.open()
+        self.__running = True
+        samples = self.__samples()
+        # draw the first chunk before the clock starts so tick 0 is not late by the generation time
+        values = next(samples)
+        start = loop.time() + self.__step
+        wall_start = time.time() + self.__step
+        try:
+            tick = 0
+            while self.__running and (ticks is None or tick < ticks):
+                payload = self.__format(wall_start + tick * self.__step, values)
+                deadline = start + tick * self.__step
+                await self.__wait(loop, deadline)
+                lateness = loop.time() - deadline
+
+                await asyncio.gather(*(sink.send(payload) for sink in self.__sinks))
+                values = next(samples)
+
+                self.__ticks += 1
+                self.__last_lateness = lateness
+                self.__max_lateness = max(self.__max_lateness, lateness)
+                self.__total_lateness += lateness
+                if self.on_tick is not None:
+                    self.on_tick(tick, lateness)
+                tick += 1
+        finally:
+            self.__running = False
+            for sink in self.__sinks:
+                await sink.close()
+
+
+def replay(markov_chain, sinks, step=1.0, count=1, ticks=None):
+    replayer = Replayer(markov_chain, sinks, step, count)
+    asyncio.run(replayer.run(ticks))
+    return replayer
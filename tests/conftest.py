@@ -0,0 +1,22 @@
+import os.path
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_trace(path, rows, seed, step=300):
+    rng = np.random.default_rng(seed)
+    values = np.clip(50 + np.cumsum(rng.normal(0, 8, (rows, 3)), axis=0), 0, 100)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Timestamp,CPU,Memory,Network\n")
+        for timestamp, row in zip(range(0, rows * step, step), values):
+            f.write(f"{timestamp},{row[0]:.2f},{row[1]:.2f},{row[2]:.2f}\n")
+    return str(path)
+
+
+@pytest.fixture
+def traces(tmp_path):
+    return [write_trace(tmp_path / f"{index}.csv", 500, index) for index in range(1, 4)]
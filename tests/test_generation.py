@@ -0,0 +1,81 @@
+import os.path
+
+import numpy as np
+import pytest
+
+import load_data
+from workload_generator import MarkovChain, TimeSeriesModelling, WorkloadGenerator, generate_sharded, \
+    merge_manifests, save_chunks
+
+
+HORIZON = 6000
+COUNT = 7
+
+
+def same_timeseries(left, right):
+    return len(left) == len(right) and all(
+        np.array_equal(a[key], b[key]) for a, b in zip(left, right) for key in ("Timestamp", *MarkovChain.METRICS))
+
+
+@pytest.fixture(params=["dense", "joint", "timeseries"])
+def config_path(request, traces, tmp_path):
+    if request.param == "timeseries":
+        path = str(tmp_path / "timeseries.npz")
+        TimeSeriesModelling(seasons=()).configure(traces, path)
+        return path
+    path = str(tmp_path / f"{request.param}.json")
+    markov_chain = MarkovChain(joint=request.param == "joint")
+    markov_chain.set_states(5)
+    markov_chain.configure_many(traces, 1, path)
+    return path
+
+
+def generate(config_path, directory, format="npz", workers=1, chunk_size=4096, shards=1):
+    for index in range(shards):
+        generate_sharded(config_path, 0, HORIZON, None, COUNT, directory, format, 3, workers, chunk_size,
+                         shard=(index, shards))
+    if shards > 1:
+        merge_manifests(directory)
+    return load_data.load_timeseries(directory)
+
+
+def test_sharded_generation_is_bit_identical(config_path, tmp_path):
+    expected = generate(config_path, str(tmp_path / "baseline"))
+    assert len(expected) == COUNT
+    assert same_timeseries(expected, generate(config_path, str(tmp_path / "chunks"), chunk_size=3))
+    assert same_timeseries(expected, generate(config_path, str(tmp_path / "workers"), workers=2, chunk_size=5))
+    assert same_timeseries(expected, generate(config_path, str(tmp_path / "shards"), chunk_size=4, shards=3))
+    assert same_timeseries(expected, generate(config_path, str(tmp_path / "csv"), "csv", workers=2))
+
+
+def test_generate_matches_sharded_run(config_path, tmp_path):
+    generator = WorkloadGenerator(seed=3)
+    generator.load_config(config_path)
+    expected = generate(config_path, str(tmp_path / "baseline"))
+    assert same_timeseries(expected, generator.generate(0, HORIZON, None, COUNT))
+
+
+@pytest.mark.parametrize("format", ["csv", "npz", "parquet"])
+def test_saved_chunks_round_trip(format, traces, tmp_path):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    markov_chain = MarkovChain(seed=1)
+    markov_chain.configure_many(traces, 1, str(tmp_path / "config.json"))
+    chunks = list(markov_chain.iter_generate(0, 30000, 1000, COUNT, chunk_size=4))
+    directory = str(tmp_path / format)
+    save_chunks(directory, chunks, format, partition_size=3)
+    assert same_timeseries(markov_chain.collect(chunks, COUNT), load_data.load_timeseries(directory))
+
+
+def test_parquet_microservice_split_across_row_groups(traces, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    markov_chain = MarkovChain(seed=1)
+    markov_chain.configure_many(traces, 1, str(tmp_path / "config.json"))
+    expected = markov_chain.generate(0, 30000, 1000, 3)
+    directory = str(tmp_path / "parquet")
+    files = markov_chain.save(directory, format="parquet")["Files"]
+    path = os.path.join(directory, files[0]["Path"])
+    # row groups of 7 rows cut every 31-sample series in the middle
+    pq.write_table(pq.read_table(path), path, row_group_size=7)
+    assert pq.ParquetFile(path).num_row_groups > 3
+    assert same_timeseries(expected, load_data.load_timeseries(path))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from random_streams import microservice_normals, microservice_uniforms, philox4x32, stream_key
+
+
+# known-answer vectors of the Random123 reference implementation
+PHILOX_KNOWN_ANSWERS = [
+    ((0, 0, 0, 0), (0, 0), (0x6627E8D5, 0xE169C58D, 0xBC57AC4C, 0x9B00DBD8)),
+    ((0xFFFFFFFF,) * 4, (0xFFFFFFFF,) * 2, (0x408F276D, 0x41C83B0E, 0xA20BC7C6, 0x6D5451FD)),
+    ((0x243F6A88, 0x85A308D3, 0x13198A2E, 0x03707344), (0xA4093822, 0x299F31D0),
+     (0xD16CFE09, 0x94FDCCEB, 0x5001E420, 0x24126EA1)),
+]
+
+
+@pytest.mark.parametrize("counter, key, expected", PHILOX_KNOWN_ANSWERS)
+def test_philox_known_answers(counter, key, expected):
+    assert [int(word) for word in philox4x32(counter, key)] == list(expected)
+
+
+def test_philox_batches_match_single_blocks():
+    counters = np.arange(40000, dtype=np.uint64)
+    words = philox4x32((counters, 0, 7, 0), (1, 2))
+    for index in (0, 1, 16383, 16384, 39999):
+        assert np.array_equal(words[:, index], philox4x32((index, 0, 7, 0), (1, 2)))
+
+
+def test_uniforms_do_not_depend_on_the_split():
+    key = stream_key(5)
+    full = microservice_uniforms(key, np.arange(1, 6), 0, 10, 7)
+    part = microservice_uniforms(key, np.arange(3, 5), 3, 4, 7)
+    assert np.array_equal(part, full[3:7, :, 2:4])
+    assert ((full > 0) & (full < 1)).all()
+
+
+def test_normals_do_not_depend_on_the_split():
+    key = stream_key(5)
+    full = microservice_normals(key, np.arange(1, 6), 0, 10, 3)
+    part = microservice_normals(key, np.arange(2, 4), 6, 4, 3)
+    assert full.shape == (10, 3, 5)
+    assert np.array_equal(part, full[6:10, :, 1:3])
+    assert np.isfinite(full).all()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from workload_generator import MarkovChain
+
+
+def same_counts(left, right):
+    return left.keys() == right.keys() and all(np.array_equal(left[key], right[key]) for key in left)
+
+
+def trained(paths, config_path, joint):
+    markov_chain = MarkovChain(joint=joint)
+    markov_chain.set_states(5)
+    markov_chain.configure_many(paths, 1, config_path)
+    return markov_chain
+
+
+@pytest.mark.parametrize("joint", [False, True])
+def test_update_equals_retrain(joint, traces, tmp_path):
+    with open(traces[0], "rb") as f:
+        data = f.read()
+    # the first part ends in the middle of a row, as a trace that is still being written would
+    middle = data.index(b"\n", len(data) // 2) + 5
+    trace = str(tmp_path / "trace.csv")
+    with open(trace, "wb") as f:
+        f.write(data[:middle])
+    config_path = str(tmp_path / "update.json")
+    with pytest.warns(UserWarning, match="no line break"):
+        trained([trace], config_path, joint)
+
+    with open(trace, "ab") as f:
+        f.write(data[middle:])
+    updated = MarkovChain(5)
+    updated.load_config(config_path)
+    assert updated.update(trace, config_path=config_path) > 0
+
+    retrained = trained([trace], str(tmp_path / "retrain.json"), joint)
+    assert same_counts(updated.transition_counts, retrained.transition_counts)
+
+
+@pytest.mark.parametrize("joint", [False, True])
+def test_update_with_nothing_appended_keeps_counts(joint, traces, tmp_path):
+    config_path = str(tmp_path / "config.json")
+    markov_chain = trained(traces[:1], config_path, joint)
+    assert markov_chain.update(traces[0], config_path=config_path) == 0
+    assert same_counts(markov_chain.transition_counts,
+                       trained(traces[:1], str(tmp_path / "retrain.json"), joint).transition_counts)
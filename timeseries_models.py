@@ -0,0 +1,155 @@
+import numpy as np
+
+from load_data import TIMESERIES_METRICS as METRICS
+
+
+DAY = 86400
+WEEK = 7 * DAY
+
+
+def seasonal_lags(step, order=3, seasons=(DAY, WEEK), length=None):
+    lags = list(range(1, order + 1))
+    for season in seasons:
+        lag = season // step
+        # a seasonal lag needs at least one full season of targets left after the lagged window
+        if lag > (lags[-1] if lags else 0) and (length is None or 2 * lag <= length):
+            lags.append(lag)
+    if not lags:
+        raise ValueError("the model needs an autoregressive order or a season that fits the traces")
+    return np.array(lags, dtype=np.int64)
+
+
+def fit_seasonal_ar(values, lags, ridge=1e-6):
+    # values: (..., T); regress y_t on [1, y_{t-lag} for lag in lags] through the normal equations,
+    # so the design matrix is never materialized and every trace and metric is solved in one batch
+    max_lag = int(lags.max())
+    length = values.shape[-1]
+    samples = length - max_lag
+    if samples <= len(lags) + 1:
+        raise ValueError("traces are too short for the requested lags")
+    target = values[..., max_lag:]
+    columns = [values[..., max_lag - lag:length - lag] for lag in lags.tolist()]
+    k = len(columns) + 1
+
+    xtx = np.empty(values.shape[:-1] + (k, k))
+    xty = np.empty(values.shape[:-1] + (k,))
+    xtx[..., 0, 0] = samples
+    xty[..., 0] = target.sum(axis=-1)
+    for i, column in enumerate(columns, start=1):
+        xtx[..., 0, i] = xtx[..., i, 0] = column.sum(axis=-1)
+        xty[..., i] = np.einsum("...t,...t->...", column, target)
+        for j in range(i, k):
+            xtx[..., i, j] = xtx[..., j, i] = np.einsum("...t,...t->...", column, columns[j - 1])
+
+    # a small ridge keeps constant traces (e.g. an idle network) solvable
+    scale = np.trace(xtx, axis1=-2, axis2=-1)[..., None] / k
+    coefficients = np.linalg.solve(xtx + ridge * scale[..., None] * np.eye(k), xty[..., None])[..., 0]
+    residual = np.einsum("...t,...t->...", target, target) - 2 * np.einsum("...k,...k->...", coefficients, xty) + \
+        np.einsum("...k,...kl,...l->...", coefficients, xtx, coefficients)
+    sigma = np.sqrt(np.maximum(residual, 0) / max(samples - k, 1))
+    return coefficients, sigma
+
+
+class SeasonalARModel:
+    def __init__(self, step, lags, coefficients, sigma, history, ends):
+        self.__step = int(step)
+        self.__lags = np.ascontiguousarray(lags, dtype=np.int64)
+        self.__coefficients = np.ascontiguousarray(coefficients, dtype=np.float64)
+        self.__sigma = np.ascontiguousarray(sigma, dtype=np.float64)
+        self.__history = np.ascontiguousarray(history, dtype=np.float64)
+        self.__ends = np.ascontiguousarray(ends, dtype=np.int64)
+        if self.__step < 1 or self.__lags.ndim != 1 or len(self.__lags) == 0 or (self.__lags < 1).any():
+            raise ValueError("Неправильна конфігурація. Некоректні лаги моделі.")
+        traces = len(self.__ends)
+        if traces == 0:
+            raise ValueError("Неправильна конфігурація. Модель не містить жодного ряду.")
+        if self.__coefficients.shape != (traces, len(METRICS), len(self.__lags) + 1) or \
+                self.__sigma.shape != (traces, len(METRICS)) or self.__history.ndim != 3 or \
+                self.__history.shape[:2] != (traces, len(METRICS)) or self.__history.shape[2] < self.max_lag:
+            raise ValueError("Неправильна конфігурація. Розміри параметрів моделі не узгоджені.")
+
+    @classmethod
+    def fit(cls, datasets, order=3, seasons=(DAY, WEEK), ridge=1e-6):
+        datasets = list(datasets)
+        if not datasets:
+            raise ValueError("No traces to fit")
+        lengths = np.array([len(dataset["Timestamp"]) for dataset in datasets])
+        steps = {int(np.median(np.diff(dataset["Timestamp"]))) for dataset in datasets if len(dataset["Timestamp"]) > 1}
+        if len(steps) != 1:
+            raise ValueError("all traces must share one sampling step")
+        step = steps.pop()
+        lags = seasonal_lags(step, order, seasons, int(lengths.min()))
+        history_length = min(int(lengths.min()), 2 * int(lags.max()))
+
+        coefficients = np.empty((len(datasets), len(METRICS), len(lags) + 1))
+        sigma = np.empty((len(datasets), len(METRICS)))
+        history = np.empty((len(datasets), len(METRICS), history_length))
+        ends = np.array([dataset["Timestamp"][-1] for dataset in datasets], dtype=np.int64)
+        # traces of equal length share one batched solve
+        for length in np.unique(lengths):
+            members = np.flatnonzero(lengths == length)
+            values = np.stack([np.stack([np.asarray(datasets[index][key], dtype=np.float64) for key in METRICS])
+                               for index in members.tolist()])
+            coefficients[members], sigma[members] = fit_seasonal_ar(values, lags, ridge)
+            history[members] = values[..., -history_length:]
+        return cls(step, lags, coefficients, sigma, history, ends)
+
+    @property
+    def step(self):
+        return self.__step
+
+    @property
+    def lags(self):
+        return self.__lags
+
+    @property
+    def max_lag(self):
+        return int(self.__lags.max())
+
+    @property
+    def traces(self):
+        return len(self.__ends)
+
+    def parameters(self, traces):
+        return self.__coefficients[traces], self.__sigma[traces]
+
+    def initial_buffers(self, traces, from_timestamp):
+        # start from the recorded history at the same phase of the longest season, so generated series keep the
+        # daily/weekly rhythm of the trace in wall-clock time
+        max_lag = self.max_lag
+        history_length = self.__history.shape[2]
+        behind = (self.__ends[traces] - (from_timestamp - self.__step)) % (max_lag * self.__step) // self.__step
+        last = history_length - 1 - behind
+        last = np.where(last >= max_lag - 1, last, history_length - 1)
+        positions = last[:, None] - max_lag + 1 + np.arange(max_lag)
+        return self.__history[traces[:, None, None], np.arange(len(METRICS))[None, :, None], positions[:, None, :]]
+
+    def next_values(self, buffers, position, coefficients, sigma, noise):
+        # buffers is a ring of the last max_lag values; slot `position` receives y_t after y_{t-max_lag} is read
+        lagged = buffers[:, :, (position - self.__lags) % self.max_lag]
+        values = coefficients[..., 0] + np.einsum("nml,nml->nm", coefficients[..., 1:], lagged) + sigma * noise
+        return np.clip(values, 0, 100)
+
+    def to_dict(self):
+        return {"Step": np.int64(self.__step), "Lags": self.__lags, "Coefficients": self.__coefficients,
+                "Sigma": self.__sigma, "History": self.__history, "Ends": self.__ends}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(np.asarray(data["Step"])), data["Lags"], data["Coefficients"], data["Sigma"], data["History"],
+                   data["Ends"])
+
+    def save(self, path):
+        np.savez(path, **self.to_dict())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls.from_dict({name: data[name] for name in data.files})
+
+
+def is_seasonal_ar_config(path):
+    if not path.endswith(".npz"):
+        return False
+    with np.load(path) as data:
+        return "Coefficients" in data.files
@@ -0,0 +1,37 @@
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskWorker(QObject):
+    progress = pyqtSignal(int)
+    chunk = pyqtSignal(object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, task, *args):
+        super(TaskWorker, self).__init__()
+        self.__task = task
+        self.__args = args
+        self.__cancel_requested = False
+
+    def cancel(self):
+        self.__cancel_requested = True
+
+    def check_cancelled(self):
+        if self.__cancel_requested:
+            raise TaskCancelled()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            result = self.__task(self, *self.__args)
+        except TaskCancelled:
+            self.cancelled.emit()
+        except Exception as ex:
+            self.failed.emit(str(ex))
+        else:
+            self.finished.emit(result)
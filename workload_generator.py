@@ -1,32 +1,409 @@
+import argparse
+import hashlib
 import json
 import numpy as np
-import pandas as pd
-import matplotlib
-import matplotlib.pyplot as plt
 import os.path
-import csv
+import glob
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
+from itertools import repeat
 
+import instrumentation
+import load_data
+from markov_models import DenseMarkovModel, SparseJointModel, count_joint_transitions, encode_joint_states, \
+    joint_states, load_model, merge_joint_counts, model_from_dict
+from random_streams import microservice_normals, microservice_uniforms, seed_sequence, stream_key
+from timeseries_models import DAY, WEEK, SeasonalARModel, is_seasonal_ar_config
 
-matplotlib.use("TkAgg")
 
+def digitize_metrics(dataset, bins):
+    return np.stack([np.digitize(dataset[key], bins[key]) for key in MarkovChain.METRICS])
 
-class MarkovChain:
-    def __init__(self, states=4):
+
+def count_state_transitions(metric_states, states):
+    transition_count = {}
+    for key, state_index in zip(MarkovChain.METRICS, metric_states):
+        transitions = state_index[:-1] * states + state_index[1:]
+        transition_count[key] = np.bincount(transitions, minlength=states ** 2).reshape(states, states)
+    return transition_count
+
+
+def count_transitions(dataset, states, bins, joint=False):
+    if joint:
+        return count_joint_transitions(joint_states(dataset, states, bins), states)
+    return count_state_transitions(digitize_metrics(dataset, bins), states)
+
+
+def train_file(path, states, bins, joint=False):
+    record = load_data.load_dataset_record(path)
+    if record["Tail"]:
+        # update resumes at the recorded offset, so the unterminated row is counted once it is complete
+        warnings.warn(f"{path}: the last row has no line break and is left for a later update")
+    dataset = {key: record[key][:record["Rows"]] for key in ("Timestamp", *MarkovChain.METRICS)}
+    last_state = digitize_metrics({key: dataset[key][-1:] for key in MarkovChain.METRICS}, bins)[:, -1] \
+        if len(dataset["Timestamp"]) else None
+    return count_transitions(dataset, states, bins, joint), int(record["Offset"]), last_state
+
+
+SAVE_FORMATS = ("csv", "npz", "parquet")
+MANIFEST_SUFFIX = ".manifest.json"
+PARQUET_ROW_GROUP_ROWS = 1 << 20
+# upper bound on uniforms drawn per call, so the random words never outgrow the chunk they feed
+UNIFORM_BLOCK = 1 << 22
+# upper bound on microservice-timestamps per chunk, so a large fleet gets shorter chunks instead of more memory
+CHUNK_SAMPLES = 1 << 22
+
+
+def chunk_steps(chunk_size, count):
+    return max(1, min(chunk_size, CHUNK_SAMPLES // max(count, 1)))
+
+
+def chunk_microservices(chunk):
+    if "Microservice" in chunk:
+        return np.asarray(chunk["Microservice"])
+    return np.arange(1, len(chunk[MarkovChain.METRICS[0]]) + 1)
+
+
+def chunk_partitions(count, partition_size=None):
+    size = partition_size or max(count, 1)
+    if size < 1:
+        raise ValueError("partition_size must be positive")
+    return [slice(start, start + size) for start in range(0, count, size)]
+
+
+def model_digest(arrays):
+    digest = hashlib.sha256()
+    for key, values in sorted(arrays.items()):
+        digest.update(key.encode("utf-8"))
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def collect_chunks(chunks, count=None):
+    chunks = list(chunks)
+    if not chunks:
+        chunks = [{"Timestamp": np.empty(0, dtype=np.int64)}]
+        chunks[0].update({key: np.empty((count or 0, 0), dtype=np.int64) for key in MarkovChain.METRICS})
+    timestamps = np.concatenate([chunk["Timestamp"] for chunk in chunks])
+    columns = {key: np.concatenate([chunk[key] for chunk in chunks], axis=1) if len(chunks) > 1 else chunks[0][key]
+               for key in MarkovChain.METRICS}
+    collected = []
+    for i in range(len(columns[MarkovChain.METRICS[0]])):
+        timeseries = {"Timestamp": timestamps}
+        for key in MarkovChain.METRICS:
+            timeseries[key] = columns[key][i]
+        collected.append(timeseries)
+    return collected
+
+
+def stack_timeseries(timeseries):
+    chunk = {"Microservice": np.arange(1, len(timeseries) + 1), "Timestamp": timeseries[0]["Timestamp"]}
+    for key in MarkovChain.METRICS:
+        chunk[key] = np.stack([series[key] for series in timeseries])
+    return chunk
+
+
+def microservice_ranges(microservices):
+    microservices = np.unique(np.asarray(microservices, dtype=np.int64))
+    if len(microservices) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(microservices) != 1)
+    firsts = microservices[np.r_[0, breaks + 1]]
+    lasts = microservices[np.r_[breaks, len(microservices) - 1]]
+    return [[int(first), int(last)] for first, last in zip(firsts, lasts)]
+
+
+def merge_ranges(ranges):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def shard_range(count, index, total):
+    if total < 1 or not 0 <= index < total:
+        raise ValueError("shard index must be between 0 and total - 1")
+    size, extra = divmod(count, total)
+    return 1 + index * size + min(index, extra), size + (index < extra)
+
+
+def save_csv_chunks(directory, chunks):
+    header = ",".join(["Timestamp", *MarkovChain.METRICS]) + "\n"
+    row_format = ",".join(["%d"] * (len(MarkovChain.METRICS) + 1)) + "\n"
+    started = set()
+    for chunk in chunks:
+        for row, microservice in enumerate(chunk_microservices(chunk).tolist()):
+            with instrumentation.phase("write"):
+                block = np.column_stack([chunk["Timestamp"], *(chunk[key][row] for key in MarkovChain.METRICS)])
+                text = (row_format * len(block)) % tuple(block.ravel().tolist())
+                if microservice not in started:
+                    text = header + text
+                with open(f'{directory}/{microservice}.csv', 'a' if microservice in started else 'w',
+                          newline='') as f:
+                    f.write(text)
+                started.add(microservice)
+            instrumentation.count("bytes_written", len(text))
+    return [f"{microservice}.csv" for microservice in sorted(started)]
+
+
+def save_npz_chunks(directory, chunks, partition_size=None, prefix="part"):
+    files = []
+    part = 0
+    for chunk in chunks:
+        microservices = chunk_microservices(chunk)
+        for partition in chunk_partitions(len(microservices), partition_size):
+            path = f'{directory}/{prefix}-{part:05d}.npz'
+            with instrumentation.phase("write"):
+                np.savez_compressed(path, Microservice=microservices[partition], Timestamp=chunk["Timestamp"],
+                                    **{key: chunk[key][partition] for key in MarkovChain.METRICS})
+            instrumentation.count("bytes_written", os.path.getsize(path))
+            files.append(os.path.basename(path))
+            part += 1
+    return files
+
+
+def save_parquet_chunks(directory, chunks, partition_size=None, prefix="part"):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires the pyarrow package") from e
+
+    writers = {}
+    try:
+        for chunk in chunks:
+            microservices = chunk_microservices(chunk)
+            timestamps = chunk["Timestamp"]
+            for part, partition in enumerate(chunk_partitions(len(microservices), partition_size)):
+                with instrumentation.phase("write"):
+                    ids = microservices[partition]
+                    columns = {"Microservice": np.repeat(ids, len(timestamps)),
+                               "Timestamp": np.tile(timestamps, len(ids))}
+                    for key in MarkovChain.METRICS:
+                        columns[key] = np.ascontiguousarray(chunk[key][partition]).ravel()
+                    table = pa.table(columns)
+                    if part not in writers:
+                        writers[part] = pq.ParquetWriter(f'{directory}/{prefix}-{part:05d}.parquet', table.schema,
+                                                         compression="zstd")
+                    # row groups hold whole series, so readers never see a microservice split across two of them
+                    writers[part].write_table(table, row_group_size=len(timestamps) *
+                                              max(1, PARQUET_ROW_GROUP_ROWS // max(len(timestamps), 1)))
+    finally:
+        for part, writer in writers.items():
+            writer.close()
+            instrumentation.count("bytes_written", os.path.getsize(f'{directory}/{prefix}-{part:05d}.parquet'))
+    return [f'{prefix}-{part:05d}.parquet' for part in sorted(writers)]
+
+
+def save_chunks(directory, chunks, format="csv", partition_size=None, prefix="part"):
+    if format not in SAVE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(SAVE_FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    if format == "csv":
+        return save_csv_chunks(directory, chunks)
+    if format == "npz":
+        return save_npz_chunks(directory, chunks, partition_size, prefix)
+    return save_parquet_chunks(directory, chunks, partition_size, prefix)
+
+
+def write_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_run(directory, chunks, run, format="csv", partition_size=None, prefix="part"):
+    ranges, previous = [], None
+
+    def recorded():
+        nonlocal previous
+        for chunk in chunks:
+            # the chunks of one run share their id array, so it is turned into ranges once instead of per chunk
+            microservices = chunk_microservices(chunk)
+            if microservices is not previous:
+                ranges.extend(microservice_ranges(microservices))
+                previous = microservices
+            yield chunk
+
+    manifest_path = os.path.join(directory, f"{prefix}{MANIFEST_SUFFIX}")
+    # a rerun with the same prefix may write fewer or differently named files than the one it replaces
+    if os.path.isfile(manifest_path):
+        remove_listed_files(directory, read_manifest(manifest_path))
+    files = save_chunks(directory, recorded(), format, partition_size, prefix)
+    manifest = {"Run": run,
+                "Microservices": merge_ranges(ranges),
+                "Files": [{"Path": file, "Bytes": os.path.getsize(os.path.join(directory, file))} for file in files]}
+    write_manifest(manifest_path, manifest)
+    return manifest
+
+
+def shard_prefix(first_microservice):
+    return f"ms{first_microservice:08d}"
+
+
+def shard_manifest_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, f"ms[0-9]*{MANIFEST_SUFFIX}")))
+
+
+def read_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def merge_manifests(directory, output=load_data.MANIFEST_NAME, prefixes=None):
+    # without prefixes every shard manifest in the directory is merged, e.g. after collecting the shards of hosts
+    if prefixes is None:
+        paths = shard_manifest_paths(directory)
+    else:
+        paths = sorted(os.path.join(directory, f"{prefix}{MANIFEST_SUFFIX}") for prefix in prefixes)
+    if not paths:
+        raise FileNotFoundError(f"No shard manifests in {directory}")
+    manifests = [read_manifest(path) for path in paths]
+    run = manifests[0]["Run"]
+    if any(manifest["Run"] != run for manifest in manifests):
+        raise ValueError("Shard manifests belong to different runs")
+
+    ranges = sorted((*bounds, os.path.basename(path))
+                    for path, manifest in zip(paths, manifests) for bounds in manifest["Microservices"])
+    for (_, previous_last, previous_path), (first, _, path) in zip(ranges, ranges[1:]):
+        if first <= previous_last:
+            raise ValueError(f"Microservice {first} was generated by more than one shard ({previous_path}, {path})")
+    microservices = merge_ranges([first, last] for first, last, _ in ranges)
+    if run.get("Count") is not None and microservices != [[1, run["Count"]]]:
+        raise ValueError(f"Shards cover microservices {microservices}, expected [[1, {run['Count']}]]")
+
+    manifest = {"Run": run, "Shards": [os.path.basename(path) for path in paths], "Microservices": microservices,
+                "Files": sorted((file for manifest in manifests for file in manifest["Files"]),
+                                key=lambda file: file["Path"])}
+    write_manifest(os.path.join(directory, output), manifest)
+    return manifest
+
+
+def remove_listed_files(directory, manifest, keep=()):
+    for file in manifest["Files"]:
+        if file["Path"] not in keep:
+            try:
+                os.remove(os.path.join(directory, file["Path"]))
+            except FileNotFoundError:
+                pass
+
+
+def remove_stale_shards(directory, manifest):
+    # shards of an earlier run into the same directory would otherwise be read back together with this one
+    current = set(manifest["Shards"]) | {file["Path"] for file in manifest["Files"]}
+    for path in shard_manifest_paths(directory):
+        if os.path.basename(path) not in current:
+            remove_listed_files(directory, read_manifest(path), current)
+            os.remove(path)
+
+
+class SeriesGenerator:
+    METRICS = load_data.TIMESERIES_METRICS
+
+    def __init__(self, seed=None):
+        self.__timeseries = []
+        self.__run = None
+        self.set_seed(seed)
+
+    def set_seed(self, seed):
+        self.__seed = seed_sequence(seed)
+
+    def configured_model(self):
+        raise NotImplementedError
+
+    def model_digest(self):
+        return model_digest(self.configured_model().to_dict())
+
+    def run_info(self, format="csv", partition_size=None, count=None):
+        if self.__run is None:
+            raise ValueError("Nothing has been generated yet")
+        run = dict(self.__run, Format=format, PartitionSize=partition_size)
+        if count is not None:
+            run["Count"] = count
+        return run
+
+    def run_chunks(self, from_timestamp, to_timestamp, step, count, chunk_size, first_microservice, sampler, **run):
+        # sampler(microservices, stream) returns fill(timestamps, values), which samples one chunk into values
+        run = {"Model": self.model_digest(), "Seed": self.__seed.entropy, "SpawnKey": list(self.__seed.spawn_key),
+               "From": from_timestamp, "To": to_timestamp, "Step": step, "Count": first_microservice + count - 1,
+               **run}
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.__run = run
+        return self.__iter_chunks(from_timestamp, to_timestamp, step, count, chunk_size, first_microservice, sampler)
+
+    def __iter_chunks(self, from_timestamp, to_timestamp, step, count, chunk_size, first_microservice, sampler):
+        microservices = np.arange(first_microservice, first_microservice + count)
+        fill = sampler(microservices, stream_key(self.__seed))
+        chunk_size = chunk_steps(chunk_size, count)
+
+        for chunk_start in range(from_timestamp, to_timestamp + 1, step * chunk_size):
+            with instrumentation.phase("sample"):
+                timestamps = np.arange(chunk_start, min(chunk_start + step * chunk_size, to_timestamp + 1), step,
+                                       dtype=np.int64)
+                values = np.empty((len(self.METRICS), count, len(timestamps)), dtype=np.int64)
+                fill(timestamps, values)
+            instrumentation.count("samples", values.size)
+
+            chunk = {"Microservice": microservices, "Timestamp": timestamps}
+            for index, key in enumerate(self.METRICS):
+                chunk[key] = values[index]
+            yield chunk
+
+    def collect(self, chunks, count=None):
+        self.__timeseries = collect_chunks(chunks, count)
+        return self.__timeseries.copy()
+
+    def save(self, directory='timeseries', timeseries=None, format="csv", partition_size=None, prefix="part"):
+        if timeseries is None:
+            timeseries = [stack_timeseries(self.__timeseries)] if self.__timeseries else []
+        if self.__run is None:
+            return {"Files": save_chunks(directory, timeseries, format, partition_size, prefix)}
+        return save_run(directory, timeseries, self.run_info(format, partition_size), format, partition_size, prefix)
+
+    def show_plot(self, index, points=2000, method="minmax"):
+        if index < 0 or index >= len(self.__timeseries):
+            raise IndexError("Index out of range")
+        import plot
+        plot.plot_series(self.__timeseries[index], points=points, method=method)
+
+    def show_plots(self, indexes=None, points=2000, method="minmax"):
+        indexes = range(len(self.__timeseries)) if indexes is None else indexes
+        if any(index < 0 or index >= len(self.__timeseries) for index in indexes):
+            raise IndexError("Index out of range")
+        import plot
+        plot.plot_series([self.__timeseries[index] for index in indexes], [str(index + 1) for index in indexes],
+                         points, method)
+
+
+class MarkovChain(SeriesGenerator):
+    MAX_STATES = 100
+
+    def __init__(self, states=4, seed=None, binary_config=False, joint=False):
+        super().__init__(seed)
         self.__states = states
         self.__transition_matrix = {
             "CPU": np.zeros((states, states)),
             "Memory": np.zeros((states, states)),
             "Network": np.zeros((states, states)),
         }
-        self.__timeseries = [{
-            "Timestamp": [],
-            "CPU": [],
-            "Memory": [],
-            "Network": [],
-        }]
         self.__current_state = 0
         self.__is_configured = False
+        self.__bins = {}
+        self.set_bins()
+        self.__file_transition_counts = {}
+        self.__counts = None
+        self.__sources = {}
+        self.__dataset_path = None
+        self.__model = None
+        self.__binary_config = binary_config
+        self.__joint = joint
 
     @property
     def current_state(self):
@@ -44,58 +421,186 @@ class MarkovChain:
     @staticmethod
     def prepare_count_matrix(transition_count_matrix):
         for key in transition_count_matrix:
-            for i in range(len(transition_count_matrix[key])):
-                for j in range(len(transition_count_matrix[key][i])):
-                    if transition_count_matrix[key][i][j] == 0:
-                        transition_count_matrix[key][i][j] = 1
-
-    def configure(self, path="timeseries.csv"):
-        transition_count = {
-            "CPU": [[0 for i in range(self.__states)] for j in range(self.__states)],
-            "Memory": [[0 for i in range(self.__states)] for j in range(self.__states)],
-            "Network": [[0 for i in range(self.__states)] for j in range(self.__states)],
-        }
-        with open(path, "r") as f:
-            reader = csv.reader(f)
-            reader.__next__()
-            first_row = next(reader)
-            current_states = {"CPU": 0, "Memory": 0, "Network": 0}
-
-            for i in range(1, self.__states + 1):
-                if float(first_row[1]) <= i * 20:
-                    current_states["CPU"] = i - 1
-            for i in range(1, self.__states + 1):
-                if float(first_row[2]) <= i * 20:
-                    current_states["Memory"] = i - 1
-            for i in range(1, self.__states + 1):
-                if float(first_row[3]) <= i * 20:
-                    current_states["Network"] = i - 1
-
-            for row in reader:
-                for i in range(1, self.__states + 1):
-                    if float(row[1]) <= i * 20:
-                        transition_count["CPU"][current_states["CPU"]][i - 1] += 1
-                        current_states["CPU"] = i - 1
-                for i in range(1, self.__states + 1):
-                    if float(row[2]) <= i * 20:
-                        transition_count["Memory"][current_states["Memory"]][i - 1] += 1
-                        current_states["Memory"] = i - 1
-                for i in range(1, self.__states + 1):
-                    if float(row[3]) <= i * 20:
-                        transition_count["Network"][current_states["Network"]][i - 1] += 1
-                        current_states["Network"] = i - 1
-
-        for key in transition_count:
-            for i in range(len(transition_count[key])):
-                self.prepare_count_matrix(transition_count)
-                state_count_sum = sum(transition_count[key][i])
-                multiplier = 1 / state_count_sum
-                for j in range(len(transition_count[key][i]) - 1):
-                    self.__transition_matrix[key][i][j] = multiplier * transition_count[key][i][j]
-                self.__transition_matrix[key][i][-1] = 1 - sum(self.__transition_matrix[key][i])
+            transition_count_matrix[key][transition_count_matrix[key] == 0] = 1
+
+    def default_bins(self):
+        band = int(100 / self.__states)
+        return [band * i for i in range(1, self.__states)]
+
+    def set_bins(self, bins=None):
+        self.__reset_counts()
+        if bins is None:
+            self.__bins = {key: self.default_bins() for key in self.METRICS}
+            return
+        if not isinstance(bins, dict):
+            bins = {key: bins for key in self.METRICS}
+        for key in self.METRICS:
+            edges = [float(edge) for edge in bins[key]]
+            if len(edges) != self.__states - 1:
+                raise ValueError("bins must contain states - 1 edges")
+            if any(left >= right for left, right in zip(edges, edges[1:])):
+                raise ValueError("bins must be strictly increasing")
+            self.__bins[key] = edges
+
+    @property
+    def bins(self):
+        return {key: list(edges) for key, edges in self.__bins.items()}
+
+    @property
+    def joint(self):
+        return self.__joint
+
+    def set_joint(self, joint):
+        self.__joint = joint
+        self.__reset_counts()
+        self.__model = None
+        self.__is_configured = False
 
+    def count_transitions(self, dataset):
+        return count_transitions(dataset, self.__states, self.__bins, self.__joint)
+
+    @property
+    def model(self):
+        return self.__model
+
+    def __set_model(self, model):
+        self.__model = model
+        self.__joint = isinstance(model, SparseJointModel)
+        self.__transition_matrix = model.to_dict()
         self.__is_configured = True
-        self.save_config(path)
+
+    @property
+    def file_transition_counts(self):
+        return dict(self.__file_transition_counts)
+
+    @property
+    def transition_counts(self):
+        if self.__counts is None:
+            return None
+        return {key: counts.copy() for key, counts in self.__counts.items()}
+
+    def __reset_counts(self):
+        self.__counts = None
+        self.__sources = {}
+
+    def __merge_counts(self, transition_counts):
+        if self.__joint:
+            return merge_joint_counts(transition_counts)
+        transition_count = {key: np.zeros((self.__states, self.__states), dtype=np.float64) for key in self.METRICS}
+        for counts in transition_counts:
+            for key in self.METRICS:
+                transition_count[key] += counts[key]
+        return transition_count
+
+    def __model_from_counts(self):
+        if self.__joint:
+            return SparseJointModel.from_counts(self.__states, self.__counts["Transitions"], self.__counts["Counts"])
+        transition_count = {key: self.__counts[key].copy() for key in self.METRICS}
+        self.prepare_count_matrix(transition_count)
+        return DenseMarkovModel(
+            {key: transition_count[key] / transition_count[key].sum(axis=1, keepdims=True) for key in transition_count})
+
+    def configure_from_counts(self, transition_counts):
+        self.__sources = {}
+        self.__counts = self.__merge_counts(transition_counts)
+        self.__set_model(self.__model_from_counts())
+
+    def __configure_from_files(self, paths, results):
+        counts = [result[0] for result in results]
+        self.__file_transition_counts = dict(zip(paths, counts))
+        self.configure_from_counts(counts)
+        # sources are keyed by the resolved path, so ./g15.csv and g15.csv continue from the same offset
+        self.__sources = {os.path.realpath(path): (offset, last_state)
+                          for path, (_, offset, last_state) in zip(paths, results) if last_state is not None}
+
+    def __cache_entry(self, path):
+        # the raw counts and read position travel with the model, so a cached configure can still be updated
+        entry = dict(self.__transition_matrix)
+        entry.update({f"Counts.{key}": counts for key, counts in self.__counts.items()})
+        source = self.__sources.get(os.path.realpath(path))
+        if source is not None:
+            entry["Offset"], entry["LastState"] = np.int64(source[0]), source[1]
+        return entry
+
+    def __load_cache_entry(self, path, entry):
+        self.__reset_counts()
+        self.__set_model(model_from_dict(entry))
+        counts = {key[len("Counts."):]: values for key, values in entry.items() if key.startswith("Counts.")}
+        if counts:
+            self.__counts = counts
+        if "Offset" in entry:
+            self.__sources[os.path.realpath(path)] = (int(entry["Offset"]), entry["LastState"])
+
+    def configure(self, path="timeseries.csv", cache=None, config_path="config.json"):
+        if cache is not None:
+            key = cache.key(path, self.__states, self.bins, self.__joint)
+            entry = cache.get(key)
+            if entry is not None:
+                self.__load_cache_entry(path, entry)
+                self.save_config(path, config_path)
+                return
+
+        with instrumentation.phase("configure"):
+            self.__configure_from_files([path], [train_file(path, self.__states, self.__bins, self.__joint)])
+        if cache is not None:
+            cache.put(key, self.__cache_entry(path))
+        self.save_config(path, config_path)
+
+    def configure_many(self, paths, workers=None, config_path="config.json"):
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(paths))
+        if not paths:
+            raise FileNotFoundError("No dataset files to configure from")
+        with instrumentation.phase("configure"):
+            if workers == 1 or len(paths) == 1:
+                results = [train_file(path, self.__states, self.__bins, self.__joint) for path in paths]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = instrumentation.map_collected(executor, train_file, paths, repeat(self.__states),
+                                                            repeat(self.__bins), repeat(self.__joint))
+            self.__configure_from_files(paths, results)
+        self.save_config(list(paths), config_path)
+
+    def update(self, path_or_rows, decay=None, source=None, config_path="config.json"):
+        if self.__counts is None:
+            raise ValueError("No transition counts to update, configure the model from a dataset first")
+        if decay is not None and not 0 < decay <= 1:
+            raise ValueError("decay must be in (0, 1]")
+
+        if isinstance(path_or_rows, str):
+            source = source or os.path.realpath(path_or_rows)
+            offset, last_state = self.__sources.get(source, (0, None))
+            with instrumentation.phase("read_appended_rows"):
+                rows, offset = load_data.read_appended_rows(path_or_rows, offset)
+        else:
+            source = source or "rows"
+            offset, last_state = self.__sources.get(source, (0, None))
+            rows = path_or_rows
+
+        metric_states = digitize_metrics(rows, self.__bins)
+        if metric_states.shape[1] == 0:
+            if source in self.__sources:
+                self.__sources[source] = (offset, last_state)
+            return 0
+        # the first new row continues from the last state seen in this source
+        if last_state is not None:
+            metric_states = np.column_stack([last_state, metric_states])
+        self.__sources[source] = (offset, metric_states[:, -1])
+
+        with instrumentation.phase("update"):
+            if self.__joint:
+                new_counts = count_joint_transitions(encode_joint_states(metric_states, self.__states), self.__states)
+            else:
+                new_counts = count_state_transitions(metric_states, self.__states)
+            counts = dict(self.__counts)
+            if decay is not None:
+                for key in ("Counts",) if self.__joint else self.METRICS:
+                    counts[key] = counts[key] * decay
+            self.__counts = self.__merge_counts([counts, new_counts])
+            self.__set_model(self.__model_from_counts())
+        instrumentation.count("update_rows", len(rows[self.METRICS[0]]))
+        self.save_config(self.__dataset_path, config_path)
+        return len(rows[self.METRICS[0]])
 
     @staticmethod
     def prepare_config_to_json(transition_matrix: dict):
@@ -107,141 +612,479 @@ class MarkovChain:
     def set_states(self, states):
         if not isinstance(states, int):
             raise TypeError("states must be an integer")
-        if states < 1 or states > 20:
-            raise ValueError("states must be between 1 and 20")
+        if states < 1 or states > self.MAX_STATES:
+            raise ValueError(f"states must be between 1 and {self.MAX_STATES}")
         self.__states = states
         self.__transition_matrix = {
             "CPU": np.zeros((states, states)),
             "Memory": np.zeros((states, states)),
             "Network": np.zeros((states, states)),
         }
+        self.__model = None
+        self.__is_configured = False
+        self.set_bins()
 
-    def save_config(self, dataset_path):
-        json_data = {"DatasetPath": dataset_path, "MarkovChain": self.prepare_config_to_json(self.__transition_matrix)}
-        with open("config.json", "w", encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False)
+    def save_config(self, dataset_path, path="config.json"):
+        self.__dataset_path = dataset_path
+        with instrumentation.phase("save_config"):
+            json_data = {"DatasetPath": dataset_path,
+                         "JointMarkovChain" if self.__joint else "MarkovChain":
+                             self.prepare_config_to_json(self.__transition_matrix),
+                         "Bins": self.bins}
+            with open(path, "w", encoding='utf-8') as f:
+                json.dump(json_data, f, ensure_ascii=False)
+            if self.__binary_config and self.__model is not None:
+                self.__model.save(self.binary_config_path(path), self.__bins)
+            if self.__counts is not None:
+                self.save_counts(self.counts_path(path))
+
+    @staticmethod
+    def binary_config_path(path):
+        return f"{os.path.splitext(path)[0]}.npz"
+
+    @staticmethod
+    def counts_path(path):
+        return f"{os.path.splitext(path)[0]}.counts.npz"
+
+    def save_counts(self, path):
+        sources = list(self.__sources)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, States=self.__states, Joint=self.__joint,
+                 Bins=np.array([self.__bins[key] for key in self.METRICS], dtype=np.float64).reshape(len(self.METRICS), -1),
+                 Sources=np.array(sources, dtype=str),
+                 Offsets=np.array([self.__sources[source][0] for source in sources], dtype=np.int64),
+                 LastStates=np.array([self.__sources[source][1] for source in sources],
+                                     dtype=np.int64).reshape(-1, len(self.METRICS)),
+                 **self.__counts)
+        os.replace(tmp_path, path)
+
+    def load_counts(self, path):
+        with np.load(path) as data:
+            if int(data["States"]) != self.__states or bool(data["Joint"]) != self.__joint or \
+                    not np.array_equal(data["Bins"], np.array([self.__bins[key] for key in self.METRICS],
+                                                              dtype=np.float64).reshape(len(self.METRICS), -1)):
+                return False
+            keys = ("Transitions", "Counts") if self.__joint else self.METRICS
+            self.__counts = {key: data[key] for key in keys}
+            self.__sources = {str(source): (int(offset), last_state) for source, offset, last_state in
+                              zip(data["Sources"], data["Offsets"], data["LastStates"])}
+        return True
 
     def check_config(self, dataset):
         if len(dataset["CPU"]) != self.__states or \
                 len(dataset["Memory"]) != self.__states or \
                 len(dataset["Network"]) != self.__states:
             raise ValueError("Неправильна конфігурація. Розмір матриці має бути рівним кількості станів")
-        for i in range(len(dataset["CPU"])):
-            if len(dataset["CPU"][i]) != self.__states or \
-                    len(dataset["Memory"][i]) != self.__states or \
-                    len(dataset["Network"][i]) != self.__states:
-                raise ValueError("Неправильна конфігурація. Матриці мають бути квадратними.")
-        for key in dataset:
-            for state_probabilities in dataset[key]:
-                if sum(state_probabilities) != 1:
-                    raise ValueError('Неправильна конфігурація. Сума ймовірностей кожного рядка повинна бути рівною 1.')
+        model = DenseMarkovModel(dataset)
+        if model.states != self.__states:
+            raise ValueError("Неправильна конфігурація. Матриці мають бути квадратними.")
+        return model
 
     def load_config(self, path="config.json"):
         if not os.path.isfile(path):
             raise FileNotFoundError(f"No {path} file")
-        with open(path, "r", encoding='UTF-8') as f:
-            json_data = json.load(f)
-            json_data = json_data["MarkovChain"]
-            try:
-                self.check_config(json_data)
-            except ValueError as e:
-                raise ValueError(str(e))
-            self.__transition_matrix = json_data
-            self.__is_configured = True
-
-    def __generate_timeseries(self, from_timestamp, to_timestamp, step=1000):
-        first_state = np.random.randint(0, self.__states)
-        timeseries = {"Timestamp": [from_timestamp], "CPU": [first_state], "Memory": [first_state],
-                             "Network": [first_state]}
-        current_states = (first_state, first_state, first_state)
-
-        for timestamp in range(from_timestamp, to_timestamp + 1, step):
-            timeseries['Timestamp'].append(timestamp)
-
-            next_cpu_state = np.random.choice(self.__states, p=self.__transition_matrix['CPU'][current_states[0]])
-            timeseries['CPU'].append(
-                np.random.randint(int(100 / self.__states) * next_cpu_state,
-                                  int(100 / self.__states) * (next_cpu_state + 1)))
-
-            next_memory_state = np.random.choice(self.__states, p=self.__transition_matrix['Memory'][current_states[0]])
-            timeseries['Memory'].append(
-                np.random.randint(int(100 / self.__states) * next_memory_state,
-                                  int(100 / self.__states) * (next_memory_state + 1)))
-
-            next_network_state = np.random.choice(self.__states,
-                                                  p=self.__transition_matrix['Network'][current_states[0]])
-            timeseries['Network'].append(
-                np.random.randint(int(100 / self.__states) * next_network_state,
-                                  int(100 / self.__states) * (next_network_state + 1)))
-
-            current_states = (next_cpu_state, next_memory_state, next_network_state)
-        return timeseries
-
-    def generate(self, from_timestamp, to_timestamp, step=1000, count=1):
-        self.__timeseries = []
+        binary_path = path if path.endswith(".npz") else self.binary_config_path(path)
+        if os.path.isfile(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(path):
+            model, bins = load_model(binary_path)
+            if model.states != self.__states:
+                raise ValueError("Неправильна конфігурація. Розмір матриці має бути рівним кількості станів")
+            self.set_bins(bins)
+            self.__set_model(model)
+        else:
+            with open(path, "r", encoding='UTF-8') as f:
+                json_data = json.load(f)
+            bins = json_data.get("Bins")
+            self.__dataset_path = json_data.get("DatasetPath")
+            if "JointMarkovChain" in json_data:
+                model = SparseJointModel.from_dict(json_data["JointMarkovChain"])
+                if model.states != self.__states:
+                    raise ValueError("Неправильна конфігурація. Розмір матриці має бути рівним кількості станів")
+            else:
+                model = self.check_config(json_data["MarkovChain"])
+            self.set_bins(bins)
+            self.__set_model(model)
+
+        counts_path = self.counts_path(path)
+        if os.path.isfile(counts_path) and os.path.getmtime(counts_path) >= os.path.getmtime(path):
+            self.load_counts(counts_path)
+
+    def __state_values(self, states, uniforms):
+        band = int(100 / self.__states)
+        return band * states + (uniforms * band).astype(np.int64)
+
+    def configured_model(self):
         if not self.__is_configured:
             raise ValueError("Invalid configuration")
-        for i in range(count):
-            self.__timeseries.append(self.__generate_timeseries(from_timestamp, to_timestamp, step))
-        return self.__timeseries.copy()
+        return self.__model
 
-    def save(self, directory='timeseries'):
-        for num, timeseries in enumerate(self.__timeseries):
-            with open(f'{directory}/{num + 1}.csv', 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Timestamp', 'CPU', 'Memory', 'Network'])
-                for i in range(0, len(timeseries['Timestamp'])):
-                    writer.writerow([timeseries['Timestamp'][i], timeseries['CPU'][i], timeseries['Memory'][i], timeseries['Network'][i]])
+    def stationary_distribution(self):
+        marginals = self.configured_model().marginals(self.__model.stationary())
+        return {key: marginals[index] for index, key in enumerate(self.METRICS)}
 
-    def show_plot(self, index):
-        if index < 0 or index >= len(self.__timeseries):
-            raise IndexError("Index out of range")
-        df = pd.DataFrame(self.__timeseries[index])
-# TODO тут неправильно переводиться час по utc
-        df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='s')
+    def n_step_matrix(self, n):
+        matrices = self.configured_model().n_step(n)
+        if self.__joint:
+            return matrices
+        return {key: matrices[index] for index, key in enumerate(self.METRICS)}
+
+    def state_distribution(self, offset=0, initial=None):
+        model = self.configured_model()
+        if initial == "stationary":
+            return model.stationary()
+        if initial is not None:
+            raise ValueError("initial must be None or 'stationary'")
+        distribution = model.initial_distribution()
+        return model.distribution_after(distribution, offset) if offset else distribution
+
+    def expected_utilization(self, offset=None):
+        model = self.configured_model()
+        distribution = model.stationary() if offset is None else self.state_distribution(offset)
+        marginals = model.marginals(distribution)
+        band = int(100 / self.__states)
+        means = band * np.arange(self.__states) + (band - 1) / 2
+        return {key: float(marginals[index] @ means) for index, key in enumerate(self.METRICS)}
 
-        fig, axes = plt.subplots(nrows=3, ncols=1, figsize=(12, 10), sharex=True)
-        fig.suptitle('Time Series of Individual Parameters')
+    def peak_utilization(self, threshold=1e-3):
+        marginals = self.configured_model().marginals(self.__model.stationary())
+        band = int(100 / self.__states)
+        return {key: int(band * (np.flatnonzero(marginals[index] >= threshold).max() + 1) - 1)
+                for index, key in enumerate(self.METRICS)}
 
-        axes[0].plot(df['Timestamp'], df['CPU'], label='CPU', marker='o', linestyle='-', linewidth=0.5, markersize=3)
-        axes[0].set_ylabel('CPU Usage (%)')
-        axes[0].legend()
-        axes[0].grid(True)
+    def iter_generate(self, from_timestamp, to_timestamp, step=1000, count=1, chunk_size=4096, first_microservice=1,
+                      initial=None, start_offset=0):
+        return self.run_chunks(from_timestamp, to_timestamp, step, count, chunk_size, first_microservice,
+                               partial(self.__sampler, initial=initial, start_offset=start_offset),
+                               Initial=initial, StartOffset=start_offset)
 
-        axes[1].plot(df['Timestamp'], df['Memory'], label='Memory', marker='o', linestyle='-', linewidth=0.5, markersize=3)
-        axes[1].set_ylabel('Memory Usage (%)')
-        axes[1].legend()
-        axes[1].grid(True)
+    def __sampler(self, microservices, stream, initial, start_offset):
+        model = self.__model
+        # each timestamp consumes one row of uniforms per microservice: chain moves first, then value offsets
+        width = model.chains + len(self.METRICS)
+        block = max(1, UNIFORM_BLOCK // max(len(microservices) * width, 1))
+        current_states = None
+        first_step = 0
 
-        axes[2].plot(df['Timestamp'], df['Network'], label='Network', marker='o', linestyle='-', linewidth=0.5, markersize=3)
-        axes[2].set_ylabel('Network Usage (units)')
-        axes[2].set_xlabel('Timestamp')
-        axes[2].legend()
-        axes[2].grid(True)
+        def fill(timestamps, values):
+            nonlocal current_states, first_step
+            for block_start in range(0, len(timestamps), block):
+                block_end = min(block_start + block, len(timestamps))
+                uniforms = microservice_uniforms(stream, microservices, first_step + block_start,
+                                                 block_end - block_start, width)
+                for i in range(block_start, block_end):
+                    row = uniforms[i - block_start]
+                    if current_states is None:
+                        if initial is None and not start_offset:
+                            current_states = model.initial_states_from(row[:model.chains])
+                        else:
+                            current_states = model.sample_states_from(
+                                self.state_distribution(start_offset, initial), row[:model.chains])
+                    else:
+                        current_states = model.next_states(current_states, row[:model.chains])
+                    values[:, :, i] = self.__state_values(model.metric_states(current_states), row[model.chains:])
+            first_step += len(timestamps)
 
-        plt.tight_layout(rect=(0.0, 0.03, 1.0, 0.95))
-        plt.show()
+        return fill
+
+    def generate(self, from_timestamp, to_timestamp, step=1000, count=1, initial=None, start_offset=0):
+        length = len(range(from_timestamp, to_timestamp + 1, step))
+        return self.collect(self.iter_generate(from_timestamp, to_timestamp, step, count, max(length, 1), 1, initial,
+                                               start_offset), count)
 
     def __str__(self):
         return str(self.__transition_matrix)
 
 
-class TimeSeriesModelling:
-    def __init__(self):
-        pass
+class TimeSeriesModelling(SeriesGenerator):
+    def __init__(self, order=3, seasons=(DAY, WEEK), seed=None, ridge=1e-6):
+        super().__init__(seed)
+        self.__order = order
+        self.__seasons = tuple(seasons)
+        self.__ridge = ridge
+        self.__model = None
+
+    @property
+    def model(self):
+        return self.__model
+
+    def configured_model(self):
+        if self.__model is None:
+            raise ValueError("Invalid configuration")
+        return self.__model
+
+    def fit(self, datasets):
+        with instrumentation.phase("configure"):
+            self.__model = SeasonalARModel.fit(datasets, self.__order, self.__seasons, self.__ridge)
+        return self.__model
+
+    def configure(self, paths, config_path="timeseries_config.npz"):
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(paths)) or [paths]
+        if not paths:
+            raise FileNotFoundError("No dataset files to configure from")
+        self.fit(load_data.load_dataset(path) for path in paths)
+        self.save_config(config_path)
+
+    def save_config(self, path="timeseries_config.npz"):
+        with instrumentation.phase("save_config"):
+            self.configured_model().save(path)
+
+    def load_config(self, path="timeseries_config.npz"):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No {path} file")
+        self.__model = SeasonalARModel.load(path)
+
+    def iter_generate(self, from_timestamp, to_timestamp, step=None, count=1, chunk_size=4096, first_microservice=1):
+        step = step or self.configured_model().step
+        return self.run_chunks(from_timestamp, to_timestamp, step, count, chunk_size, first_microservice,
+                               partial(self.__sampler, from_timestamp=from_timestamp))
+
+    def __sampler(self, microservices, stream, from_timestamp):
+        model = self.__model
+        count = len(microservices)
+        # microservices cycle through the fitted traces, each inheriting that trace's coefficients and rhythm
+        traces = (microservices - 1) % model.traces
+        coefficients, sigma = model.parameters(traces)
+        buffers = model.initial_buffers(traces, from_timestamp)
+        block = max(1, UNIFORM_BLOCK // max(count * len(self.METRICS), 1))
+        noise, noise_start = np.empty((0, len(self.METRICS), count)), 0
+        native, current = 0, None
+
+        def fill(timestamps, values):
+            nonlocal noise, noise_start, native, current
+            # the model advances at its fitted step; requested timestamps take the value of the step they fall in
+            targets = (timestamps - from_timestamp) // model.step
+            # a step that started in the previous chunk still holds for the first timestamps of this one
+            held = np.searchsorted(targets, native)
+            if held:
+                values[:, :, :held] = np.rint(current).T[:, :, None]
+            bounds = np.searchsorted(targets, np.arange(native, targets[-1] + 2))
+            for n in range(native, targets[-1] + 1):
+                if n - noise_start >= len(noise):
+                    noise = microservice_normals(stream, microservices, n, block, len(self.METRICS))
+                    noise_start = n
+                current = model.next_values(buffers, n % model.max_lag, coefficients, sigma, noise[n - noise_start].T)
+                buffers[:, :, n % model.max_lag] = current
+                first, last = bounds[n - native], bounds[n - native + 1]
+                if last > first:
+                    values[:, :, first:last] = np.rint(current).T[:, :, None]
+            native = max(native, targets[-1] + 1)
+
+        return fill
+
+    def generate(self, from_timestamp, to_timestamp, step=None, count=1):
+        step = step or self.configured_model().step
+        length = len(range(from_timestamp, to_timestamp + 1, step))
+        return self.collect(self.iter_generate(from_timestamp, to_timestamp, step, count, max(length, 1)), count)
 
 
 class WorkloadGenerator:
-    def __init__(self):
-        self.__markov_chain = MarkovChain()
-        self.__time_series_modelling = TimeSeriesModelling()
+    BACKENDS = ("markov", "timeseries")
+
+    def __init__(self, backend="markov", states=4, seed=None):
+        self.__markov_chain = MarkovChain(states, seed)
+        self.__time_series_modelling = TimeSeriesModelling(seed=seed)
+        self.__backend = None
+        self.set_backend(backend)
+
+    @property
+    def backend(self):
+        return self.__backend
+
+    def set_backend(self, backend):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(self.BACKENDS)}")
+        self.__backend = backend
+
+    @property
+    def markov_chain(self):
+        return self.__markov_chain
+
+    @property
+    def time_series_modelling(self):
+        return self.__time_series_modelling
+
+    @property
+    def active(self):
+        return self.__markov_chain if self.__backend == "markov" else self.__time_series_modelling
+
+    def set_seed(self, seed):
+        seed = seed_sequence(seed)
+        self.__markov_chain.set_seed(seed)
+        self.__time_series_modelling.set_seed(seed)
+
+    def configure(self, paths, workers=None, config_path=None):
+        if self.__backend == "markov":
+            self.__markov_chain.configure_many(paths, workers, config_path or "config.json")
+        else:
+            self.__time_series_modelling.configure(paths, config_path or "timeseries_config.npz")
+
+    def load_config(self, path):
+        if is_seasonal_ar_config(path):
+            self.set_backend("timeseries")
+            self.__time_series_modelling.load_config(path)
+        else:
+            self.set_backend("markov")
+            self.__markov_chain.set_states(config_states(path))
+            self.__markov_chain.load_config(path)
+
+    def iter_generate(self, from_timestamp, to_timestamp, step=None, count=1, chunk_size=4096, first_microservice=1):
+        if self.__backend == "markov":
+            return self.__markov_chain.iter_generate(from_timestamp, to_timestamp, step or 60, count, chunk_size,
+                                                     first_microservice)
+        return self.__time_series_modelling.iter_generate(from_timestamp, to_timestamp, step, count, chunk_size,
+                                                          first_microservice)
+
+    def generate(self, from_timestamp, to_timestamp, step=None, count=1):
+        if self.__backend == "markov":
+            return self.__markov_chain.generate(from_timestamp, to_timestamp, step or 60, count)
+        return self.__time_series_modelling.generate(from_timestamp, to_timestamp, step, count)
+
+
+def config_states(path):
+    if path.endswith(".npz"):
+        return load_model(path)[0].states
+    with open(path, "r", encoding='UTF-8') as f:
+        json_data = json.load(f)
+    if "JointMarkovChain" in json_data:
+        return json_data["JointMarkovChain"]["States"]
+    return len(json_data["MarkovChain"]["CPU"])
+
+
+def parse_shard(spec):
+    index, _, total = spec.partition("/")
+    try:
+        index, total = int(index), int(total)
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like INDEX/TOTAL, e.g. 0/4") from None
+    try:
+        shard_range(1, index, total)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+    return index, total
+
+
+def generate_shard(config_path, seed, from_timestamp, to_timestamp, step, count, first_microservice, directory,
+                   format="csv", chunk_size=4096, partition_size=None, total_count=None):
+    generator = WorkloadGenerator(seed=seed)
+    generator.load_config(config_path)
+    chunks = generator.iter_generate(from_timestamp, to_timestamp, step, count, chunk_size, first_microservice)
+    save_run(directory, chunks, generator.active.run_info(format, partition_size, total_count), format, partition_size,
+             shard_prefix(first_microservice))
+    return count
+
+
+def generate_sharded(config_path, from_timestamp, to_timestamp, step, count, directory, format="csv", seed=None,
+                     workers=None, chunk_size=4096, partition_size=None, shard=(0, 1)):
+    # every shard of a run must agree on the entropy, so an unseeded run draws it once here
+    seed = np.random.SeedSequence(seed).entropy
+    first_microservice, size = shard_range(count, *shard)
+    workers = max(1, min(workers or os.cpu_count() or 1, size))
+    ranges = [shard_range(size, i, workers) for i in range(workers)]
+    shards = [(first_microservice + first - 1, length) for first, length in ranges if length]
+    arguments = [(config_path, seed, from_timestamp, to_timestamp, step, length, first, directory, format, chunk_size,
+                  partition_size, count) for first, length in shards]
+    if len(arguments) <= 1:
+        counts = [generate_shard(*arguments[0])] if arguments else []
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = instrumentation.map_collected(executor, generate_shard, *zip(*arguments))
+    if shard[1] == 1:
+        manifest = merge_manifests(directory, prefixes=[shard_prefix(first) for first, _ in shards])
+        remove_stale_shards(directory, manifest)
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m workload_generator",
+                                     description="Train Markov chain workload models and generate timeseries.")
+    parser.add_argument("--metrics", default=None,
+                        help="write phase timings and counters here, as Prometheus text for .prom/.txt, else JSON")
+    parser.add_argument("--profile", default=None,
+                        help="run under cProfile and tracemalloc, writing <prefix>.prof and text reports")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser("train", help="train a model from one or more datasets")
+    train.add_argument("datasets", nargs="+", help="dataset CSV files or glob patterns")
+    train.add_argument("--states", type=int, default=4)
+    train.add_argument("--config", default=None,
+                       help="where to write the trained model, config.json or timeseries_config.npz by default")
+    train.add_argument("--workers", type=int, default=None)
+    train.add_argument("--joint", action="store_true", help="train one joint CPU/Memory/Network chain")
+    train.add_argument("--backend", choices=WorkloadGenerator.BACKENDS, default="markov")
+    train.add_argument("--order", type=int, default=3, help="autoregressive order of the timeseries backend")
+
+    update = subparsers.add_parser("update", help="fold rows appended to datasets into a trained model")
+    update.add_argument("datasets", nargs="+", help="dataset CSV files or glob patterns")
+    update.add_argument("--config", default="config.json")
+    update.add_argument("--decay", type=float, default=None, help="factor applied to existing counts per update")
+
+    generate = subparsers.add_parser("generate", help="generate timeseries and save them")
+    generate.add_argument("--config", default="config.json")
+    now = int(datetime.now().timestamp())
+    generate.add_argument("--from", dest="from_timestamp", type=int, default=now)
+    generate.add_argument("--to", dest="to_timestamp", type=int, default=None)
+    generate.add_argument("--step", type=int, default=None,
+                          help="seconds between samples, 60 for Markov models and the fitted step for timeseries ones")
+    generate.add_argument("--count", type=int, default=1)
+    generate.add_argument("--seed", type=int, default=None)
+    generate.add_argument("--workers", type=int, default=1)
+    generate.add_argument("--output", default="timeseries")
+    generate.add_argument("--format", choices=SAVE_FORMATS, default="csv")
+    generate.add_argument("--chunk-size", type=int, default=4096)
+    generate.add_argument("--partition-size", type=int, default=None)
+    generate.add_argument("--shard", type=parse_shard, default=(0, 1),
+                          help="generate only shard INDEX/TOTAL (zero-based) of the --count microservices")
+
+    merge = subparsers.add_parser("merge", help="combine the shard manifests in a directory into manifest.json")
+    merge.add_argument("directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metrics:
+        instrumentation.instrumentation.enable()
+        # spawned worker processes pick the switch up from the environment
+        os.environ[instrumentation.ENABLE_VARIABLE] = "1"
+    if args.profile:
+        # worker processes profile themselves into <prefix>.worker-<pid>.*
+        os.environ[instrumentation.PROFILE_VARIABLE] = args.profile
+        with instrumentation.profile(args.profile):
+            run_command(args)
+    else:
+        run_command(args)
+    if args.metrics:
+        instrumentation.instrumentation.dump(args.metrics)
 
 
-def main():
-    markov_chain = MarkovChain()
-    print(markov_chain)
-    markov_chain.generate(int(datetime.now().timestamp()), int(datetime.now().timestamp()) + 3600, 10)
-    markov_chain.show_plot()
+def run_command(args):
+    if args.command == "train":
+        paths = [path for pattern in args.datasets for path in (sorted(glob.glob(pattern)) or [pattern])]
+        if args.backend == "timeseries":
+            config_path = args.config or "timeseries_config.npz"
+            TimeSeriesModelling(args.order).configure(paths, config_path)
+            print(f"Fitted seasonal AR({args.order}) models on {len(paths)} dataset(s) -> {config_path}")
+            return
+        config_path = args.config or "config.json"
+        markov_chain = MarkovChain(joint=args.joint)
+        markov_chain.set_states(args.states)
+        markov_chain.configure_many(paths, args.workers, config_path)
+        print(f"Trained {args.states}-state model on {len(paths)} dataset(s) -> {config_path}")
+    elif args.command == "update":
+        paths = [path for pattern in args.datasets for path in (sorted(glob.glob(pattern)) or [pattern])]
+        markov_chain = MarkovChain(config_states(args.config))
+        markov_chain.load_config(args.config)
+        rows = sum(markov_chain.update(path, args.decay, config_path=args.config) for path in paths)
+        print(f"Added {rows} row(s) from {len(paths)} dataset(s) -> {args.config}")
+    elif args.command == "merge":
+        manifest = merge_manifests(args.directory)
+        print(f"Merged {len(manifest['Shards'])} shard manifest(s) -> {os.path.join(args.directory, load_data.MANIFEST_NAME)}")
+    else:
+        to_timestamp = args.to_timestamp if args.to_timestamp is not None else args.from_timestamp + 3600
+        counts = generate_sharded(args.config, args.from_timestamp, to_timestamp, args.step, args.count, args.output,
+                                  args.format, args.seed, args.workers, args.chunk_size, args.partition_size,
+                                  args.shard)
+        print(f"Generated {sum(counts)} of {args.count} timeseries -> {args.output}")
 
 
 if __name__ == '__main__':